@@ -7,3 +7,7 @@ class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
     verbose_name = 'API'
+
+    def ready(self):
+        """Подключение сигналов."""
+        from . import signals  # noqa: F401
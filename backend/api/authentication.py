@@ -0,0 +1,130 @@
+"""Аутентификация по токену через кэш."""
+
+import hashlib
+import time
+
+from django.conf import settings  # type: ignore
+from django.contrib.auth import get_user_model  # type: ignore
+from django.core.cache import cache  # type: ignore
+from django.db import transaction  # type: ignore
+from rest_framework.authentication import TokenAuthentication  # type: ignore
+
+User = get_user_model()
+
+LOCAL_TTL: int = 5
+LOCAL_MAX_ENTRIES: int = 10000
+SNAPSHOT_FIELDS = tuple(
+    field.attname for field in User._meta.concrete_fields
+    if field.attname in {'id', 'email', 'username', 'first_name',
+                         'last_name', 'avatar', 'role', 'is_superuser',
+                         'is_staff', 'is_active'}
+)
+
+
+def get_snapshot_version(fields):
+    """Версия снимка — хэш списка его полей."""
+    return hashlib.sha256(' '.join(fields).encode()).hexdigest()[:8]
+
+
+SNAPSHOT_VERSION: str = get_snapshot_version(SNAPSHOT_FIELDS)
+
+
+def get_token_cache_key(key):
+    """
+    Ключ Redis по хэшу токена: сами токены в ключах не хранятся.
+
+    Снимок — кортеж значений по позициям SNAPSHOT_FIELDS, поэтому в
+    ключ входит версия полей: после их изменения старые снимки не
+    читаются.
+    """
+    token_hash = hashlib.sha256(key.encode()).hexdigest()
+    return f'auth:token:{SNAPSHOT_VERSION}:{token_hash}'
+
+
+def get_user_snapshot(user):
+    """Поля пользователя, нужные при обработке запросов."""
+    return tuple(
+        User._meta.get_field(field).get_prep_value(getattr(user, field))
+        for field in SNAPSHOT_FIELDS
+    )
+
+
+def get_user_from_snapshot(snapshot):
+    """
+    Пользователь из снимка.
+
+    Остальные поля отложены и загрузятся из базы при обращении, save()
+    записывает только загруженные поля.
+    """
+    return User.from_db(User.objects.db, SNAPSHOT_FIELDS, snapshot)
+
+
+class TokenCache:
+    """
+    Снимки пользователей по токенам.
+
+    Первый уровень — словарь процесса на LOCAL_TTL секунд, второй —
+    Redis на CACHE_TIMEOUT. Удаление снимка из Redis доходит до других
+    процессов не позже, чем через LOCAL_TTL.
+    """
+
+    timeout = settings.CACHE_TIMEOUT
+
+    def __init__(self):
+        """Пустой словарь процесса."""
+        self.entries = {}
+
+    def get(self, key):
+        """Снимок пользователя по токену или None."""
+        entry = self.entries.get(key)
+        now = time.monotonic()
+        if entry and entry[0] > now:
+            return entry[1]
+        snapshot = cache.get(get_token_cache_key(key))
+        if snapshot is not None:
+            self.remember(key, snapshot, now)
+        return snapshot
+
+    def remember(self, key, snapshot, now):
+        """Запись в словарь процесса; при переполнении он очищается."""
+        if len(self.entries) >= LOCAL_MAX_ENTRIES:
+            self.entries.clear()
+        self.entries[key] = (now + LOCAL_TTL, snapshot)
+
+    def set(self, key, snapshot):
+        """Сохранение снимка на обоих уровнях."""
+        cache.set(get_token_cache_key(key), snapshot, self.timeout)
+        self.remember(key, snapshot, time.monotonic())
+
+    def evict(self, *keys):
+        """Удаление снимков после фиксации транзакции."""
+        def delete():
+            for key in keys:
+                self.entries.pop(key, None)
+            cache.delete_many([get_token_cache_key(key) for key in keys])
+
+        if keys:
+            transaction.on_commit(delete)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    Аутентификация по токену без запроса к базе при попадании в кэш.
+
+    При промахе токен и пользователь читаются как в TokenAuthentication,
+    и снимок пользователя сохраняется. Снимки удаляются при выходе,
+    смене пароля и изменении пользователя (api/signals.py).
+    """
+
+    def authenticate_credentials(self, key):
+        """Пользователь и токен по ключу."""
+        snapshot = token_cache.get(key)
+        if snapshot is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, get_user_snapshot(user))
+            return user, token
+        user = get_user_from_snapshot(snapshot)
+        return user, self.get_model()(key=key, user=user)
+
+
+token_cache = TokenCache()
@@ -0,0 +1,163 @@
+"""Пакетное изменение избранного и списка покупок."""
+
+from django.db import IntegrityError, connection, transaction  # type: ignore
+
+from recipes.models import Recipe
+from users import shopping_list as shopping_lists
+from users.membership import shopping_cart
+from .drf_cache import bump_cache_version
+
+MAX_BULK_RECIPES: int = 100
+ADDED: str = 'added'
+ALREADY_ADDED: str = 'already_added'
+REMOVED: str = 'removed'
+NOT_IN_LIST: str = 'not_in_list'
+NOT_FOUND: str = 'not_found'
+
+
+def get_results(recipe_ids, changed, unchanged_status, changed_status):
+    """Статус каждого id в порядке запроса."""
+    return [
+        {'id': recipe_id,
+         'status': changed_status if recipe_id in changed
+         else unchanged_status}
+        for recipe_id in recipe_ids
+    ]
+
+
+def after_change(membership_set, user_id, recipe_ids, sign):
+    """
+    Обновление производных данных после изменения в обход сигналов.
+
+    bulk_create, вставка SQL-запросом и удаление без сборщика не
+    отправляют сигналы, поэтому множество в Redis, версия кэша и сводный
+    список покупок обновляются здесь, по одному разу на пакет.
+    """
+    if sign > 0:
+        membership_set.add(user_id, *recipe_ids)
+    else:
+        membership_set.remove(user_id, *recipe_ids)
+    if membership_set is shopping_cart:
+        shopping_lists.add_recipes((user_id,), recipe_ids, sign)
+    listed_model = membership_set.object_model
+    transaction.on_commit(
+        lambda: bump_cache_version(listed_model, user_id))
+
+
+def get_link_table(membership_set):
+    """Таблица связи и ее колонки пользователя и объекта."""
+    quote = connection.ops.quote_name
+    meta = membership_set.model._meta
+    return (quote(meta.db_table),
+            quote(meta.get_field('user').column),
+            quote(meta.get_field(membership_set.object_field).column))
+
+
+def insert_returning(membership_set, user_id, recipe_ids):
+    """
+    Вставка связей на Postgres одним запросом.
+
+    Возвращает найденные id рецептов и id действительно вставленных
+    строк: INSERT ... ON CONFLICT DO NOTHING RETURNING не возвращает
+    строки, уже добавленные в том числе параллельным запросом.
+    """
+    quote = connection.ops.quote_name
+    table, user_column, object_column = get_link_table(membership_set)
+    target_meta = membership_set.object_model._meta
+    target_pk = quote(target_meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'WITH target AS ('
+            f'SELECT {target_pk} FROM {quote(target_meta.db_table)} '
+            f'WHERE {target_pk} = ANY(%s)), '
+            f'inserted AS ('
+            f'INSERT INTO {table} ({user_column}, {object_column}) '
+            f'SELECT %s, {target_pk} FROM target '
+            f'ON CONFLICT DO NOTHING RETURNING {object_column}) '
+            f'SELECT {target_pk}, {target_pk} IN '
+            f'(SELECT {object_column} FROM inserted) FROM target',
+            (list(recipe_ids), user_id),
+        )
+        rows = cursor.fetchall()
+    return ({recipe_id for recipe_id, _ in rows},
+            {recipe_id for recipe_id, inserted in rows if inserted})
+
+
+def insert_with_savepoints(membership_set, user_id, recipe_ids):
+    """Вставка связей на других базах: по строке в точке сохранения."""
+    found = set(Recipe.objects.filter(
+        pk__in=recipe_ids).order_by().values_list('pk', flat=True))
+    model = membership_set.model
+    inserted = set()
+    for recipe_id in found:
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create(
+                    (model(user_id=user_id, recipe_id=recipe_id),))
+        except IntegrityError:
+            continue
+        inserted.add(recipe_id)
+    return found, inserted
+
+
+def delete_returning(membership_set, user_id, recipe_ids):
+    """
+    Удаление связей и id действительно удаленных строк.
+
+    На Postgres — один DELETE ... RETURNING, на других базах — по
+    запросу на id с проверкой числа удаленных строк. Строку, удаленную
+    параллельным запросом, получает только один из них.
+    """
+    table, user_column, object_column = get_link_table(membership_set)
+    sql = f'DELETE FROM {table} WHERE {user_column} = %s AND '
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                f'{sql}{object_column} = ANY(%s) RETURNING {object_column}',
+                (user_id, list(recipe_ids)))
+            return {recipe_id for recipe_id, in cursor.fetchall()}
+        deleted = set()
+        for recipe_id in recipe_ids:
+            cursor.execute(f'{sql}{object_column} = %s',
+                           (user_id, recipe_id))
+            if cursor.rowcount:
+                deleted.add(recipe_id)
+        return deleted
+
+
+def add_recipes(membership_set, user_id, recipe_ids):
+    """
+    Добавление рецептов в список пользователя.
+
+    Добавленными считаются только строки, которые вставил этот запрос,
+    поэтому производные данные не меняются дважды при параллельных
+    запросах. На Postgres проверка рецептов и вставка — один запрос.
+    """
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            found, added_ids = insert_returning(
+                membership_set, user_id, recipe_ids)
+        else:
+            found, added_ids = insert_with_savepoints(
+                membership_set, user_id, recipe_ids)
+        if added_ids:
+            after_change(membership_set, user_id, added_ids, 1)
+    results = get_results(recipe_ids, added_ids, ALREADY_ADDED, ADDED)
+    for result in results:
+        if result['id'] not in found:
+            result['status'] = NOT_FOUND
+    return results
+
+
+def remove_recipes(membership_set, user_id, recipe_ids):
+    """
+    Удаление рецептов из списка пользователя без сборщика.
+
+    Производные данные меняются только для строк, которые удалил этот
+    запрос.
+    """
+    with transaction.atomic():
+        removed_ids = delete_returning(membership_set, user_id, recipe_ids)
+        if removed_ids:
+            after_change(membership_set, user_id, removed_ids, -1)
+    return get_results(recipe_ids, removed_ids, NOT_IN_LIST, REMOVED)
@@ -0,0 +1,51 @@
+"""Справочники тегов и ингредиентов в памяти для проверки записи."""
+
+from recipes.models import Ingredient, Tag
+from .drf_cache import get_cache_version
+
+
+class ReferenceCatalogue:
+    """
+    Id и нужные поля справочной модели в памяти процесса.
+
+    Загружается целиком при первом обращении и перезагружается, когда
+    меняется версия данных модели. Id, которых нет в памяти (например,
+    объект создан в другом процессе до смены версии), ищутся одним
+    запросом IN.
+    """
+
+    def __init__(self, model, *fields):
+        """Модель и поля, хранимые для каждого id."""
+        self.model = model
+        self.fields = ('id', *fields)
+        self.snapshot = (None, {})
+
+    def refresh(self):
+        """Перезагрузка, если данные модели изменились."""
+        version = get_cache_version(self.model)
+        if self.snapshot[0] != version:
+            self.snapshot = (version, {
+                row['id']: row
+                for row in self.model.objects.order_by().values(*self.fields)
+            })
+        return self.snapshot[1]
+
+    def get_rows(self, ids):
+        """Найденные объекты по id: {id: словарь полей}."""
+        rows = self.refresh()
+        found = {pk: rows[pk] for pk in ids if pk in rows}
+        missing = set(ids) - found.keys()
+        if missing:
+            found.update(
+                (row['id'], row)
+                for row in self.model.objects.filter(
+                    pk__in=missing).order_by().values(*self.fields))
+        return found
+
+    def get_missing(self, ids):
+        """Id, которых нет в базе."""
+        return set(ids) - self.get_rows(ids).keys()
+
+
+tag_catalogue = ReferenceCatalogue(Tag, 'name')
+ingredient_catalogue = ReferenceCatalogue(Ingredient, 'name')
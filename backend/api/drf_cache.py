@@ -1,23 +1,275 @@
 """Redis."""
 
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.contrib.auth import get_user_model  # type: ignore
+from django.contrib.auth.models import AnonymousUser  # type: ignore
 from django.core.cache import cache  # type: ignore
 from django.conf import settings  # type: ignore
+from django.http import HttpResponse, HttpResponseNotModified  # type: ignore
+from django.utils.cache import (patch_cache_control,  # type: ignore
+                                patch_vary_headers)
+from django.utils.http import parse_etags  # type: ignore
+from rest_framework.response import Response  # type: ignore
+
+from recipes.models import Ingredient, Recipe, Tag
+from users.membership import (favorites, get_user_members,
+                              shopping_cart, subscriptions)
+
+User = get_user_model()
+
+
+def get_cache_version_key(model, scope=None):
+    """Ключ счетчика версии данных модели, при необходимости — по области."""
+    key = f'drf:version:{model._meta.label_lower}'
+    if scope is not None:
+        key = f'{key}:{scope}'
+    return key
+
+
+def get_cache_version(model, scope=None):
+    """
+    Текущая версия данных модели.
+
+    Если счетчика нет (например, он вытеснен из Redis), создается новый
+    с уникальным значением, чтобы старые записи не могли совпасть.
+    """
+    key = get_cache_version_key(model, scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def get_cache_versions(*models, scope=None):
+    """Версии нескольких моделей за одно обращение к кэшу."""
+    keys = [get_cache_version_key(model, scope) for model in models]
+    versions = cache.get_many(keys)
+    return tuple(
+        versions[key] if key in versions else get_cache_version(model, scope)
+        for model, key in zip(models, keys)
+    )
+
+
+def bump_cache_version(model, scope=None):
+    """Сменить версию данных модели, сделав устаревшими все ответы."""
+    key = get_cache_version_key(model, scope)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def get_request_signature(request, exclude=()):
+    """Хэш пути и отсортированных параметров запроса без исключенных."""
+    query = urlencode(sorted(
+        (name, value)
+        for name, values in request.query_params.lists()
+        if name not in exclude
+        for value in values
+    ))
+    return hashlib.md5(f'{request.path_info}?{query}'.encode()).hexdigest()
 
 
 class CacheResponseMixin:
-    """Миксин для кэширования DRF API с помощью Redis."""
+    """
+    Миксин для кэширования отрендеренных ответов DRF API в Redis.
+
+    Ключ строится из пути, отсортированных параметров запроса, формата
+    ответа и версии данных модели. Версия меняется сигналами при
+    изменении модели, поэтому записи можно хранить долго.
+    """
 
     cache_timeout = settings.CACHE_TIMEOUT
 
-    def get_queryset(self):
-        """Переопределение get_queryset."""
+    def get_cache_model(self):
+        """Модель, от версии которой зависят ответы."""
+        return self.get_serializer_class().Meta.model
+
+    def get_cache_key(self, request):
+        """Ключ кэша для запроса."""
+        return (f'drf:response:{get_cache_version(self.get_cache_model())}:'
+                f'{request.accepted_renderer.format}:'
+                f'{get_request_signature(request)}')
+
+    def get_cached_response(self, handler, request, *args, **kwargs):
+        """Ответ из кэша или вызов обработчика с сохранением результата."""
         if not self.cache_timeout:
-            return super().get_queryset()
-        cache_key = (f'drf:{self.cache_timeout}:{self.request.method}:'
-                     f'{self.request.path_info}')
-        cached_queryset = cache.get(cache_key)
-        if cached_queryset is not None:
-            return cached_queryset
-        queryset = super().get_queryset()
-        cache.set(cache_key, queryset, self.cache_timeout)
-        return queryset
+            return handler(request, *args, **kwargs)
+        cache_key = self.get_cache_key(request)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+        response = handler(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+        response.accepted_renderer = request.accepted_renderer
+        response.accepted_media_type = request.accepted_media_type
+        response.renderer_context = self.get_renderer_context()
+        response.render()
+        cache.set(cache_key,
+                  (response.content, response['Content-Type']),
+                  self.cache_timeout)
+        return response
+
+    def list(self, request, *args, **kwargs):
+        """Список из кэша."""
+        return self.get_cached_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Объект из кэша."""
+        return self.get_cached_response(
+            super().retrieve, request, *args, **kwargs)
+
+
+def get_user_flags(user, recipe_ids, author_ids):
+    """
+    Id рецептов в избранном и списке покупок и id авторов в подписках.
+
+    Три множества читаются из Redis за одно обращение.
+    """
+    favorite_ids, shopping_cart_ids, subscription_ids = get_user_members(
+        user.id, favorites, shopping_cart, subscriptions)
+    return (favorite_ids & recipe_ids,
+            shopping_cart_ids & recipe_ids,
+            subscription_ids & author_ids)
+
+
+class SharedPageMixin:
+    """
+    Миксин общих для всех пользователей страниц списка рецептов.
+
+    Страница рендерится один раз как для анонимного пользователя и
+    кэшируется по версиям данных. Флаги is_favorited,
+    is_in_shopping_cart и is_subscribed подставляются для каждого
+    пользователя по его множествам id.
+    """
+
+    shared_pages = settings.SHARED_RECIPE_PAGES
+    shared_page_timeout = settings.CACHE_TIMEOUT
+    shared_page_models = (Recipe, Tag, Ingredient, User)
+    personal_query_params = ('is_favorited', 'is_in_shopping_cart')
+    shared_page = False
+
+    def get_page_user(self):
+        """Пользователь, для которого строится выборка."""
+        if self.shared_page:
+            return AnonymousUser()
+        return self.request.user
+
+    def get_serializer_context(self):
+        """Общая страница сериализуется без персональных полей."""
+        context = super().get_serializer_context()
+        context['shared'] = self.shared_page
+        return context
+
+    def is_shared_page_request(self, request):
+        """Можно ли отдать общую страницу."""
+        return (self.shared_pages
+                and self.shared_page_timeout
+                and not any(param in request.query_params
+                            for param in self.personal_query_params))
+
+    def get_shared_page_key(self, request):
+        """Ключ кэша общей страницы."""
+        versions = ':'.join(str(get_cache_version(model))
+                            for model in self.shared_page_models)
+        return (f'drf:page:{versions}:{request.get_host()}:'
+                f'{get_request_signature(request)}')
+
+    def personalize_page(self, data, user):
+        """Подстановка персональных флагов в общую страницу."""
+        if not user.is_authenticated:
+            return data
+        results = data['results']
+        favorite_ids, shopping_cart_ids, subscription_ids = get_user_flags(
+            user,
+            {recipe['id'] for recipe in results},
+            {recipe['author']['id'] for recipe in results},
+        )
+        return {**data, 'results': [
+            {**recipe,
+             'author': {
+                 **recipe['author'],
+                 'is_subscribed': recipe['author']['id'] in subscription_ids,
+             },
+             'is_favorited': recipe['id'] in favorite_ids,
+             'is_in_shopping_cart': recipe['id'] in shopping_cart_ids}
+            for recipe in results
+        ]}
+
+    def list(self, request, *args, **kwargs):
+        """Список из общей страницы с персональными флагами."""
+        if not self.is_shared_page_request(request):
+            return super().list(request, *args, **kwargs)
+        cache_key = self.get_shared_page_key(request)
+        data = cache.get(cache_key)
+        if data is None:
+            self.shared_page = True
+            try:
+                data = super().list(request, *args, **kwargs).data
+            finally:
+                self.shared_page = False
+            cache.set(cache_key, data, self.shared_page_timeout)
+        return Response(self.personalize_page(data, request.user))
+
+
+class ConditionalGetMixin:
+    """
+    Миксин условных GET-запросов по ETag.
+
+    ETag вычисляется из версий данных моделей, пути, параметров и формата
+    ответа, поэтому на совпадающий If-None-Match ответ 304 отдается без
+    запросов к базе и сериализации.
+    """
+
+    etag_models = None
+    etag_per_user = False
+
+    def get_etag_models(self):
+        """Модели, от версий которых зависит ответ."""
+        if self.etag_models is not None:
+            return self.etag_models
+        return (self.get_serializer_class().Meta.model,)
+
+    def get_etag(self, request):
+        """Сильный ETag ответа."""
+        versions = get_cache_versions(*self.get_etag_models())
+        user = request.user
+        if self.etag_per_user and user.is_authenticated:
+            versions += (user.id, *get_cache_versions(Recipe, User,
+                                                      scope=user.id))
+        digest = hashlib.md5(
+            f'{versions}:{request.accepted_renderer.format}:'
+            f'{get_request_signature(request)}'.encode()).hexdigest()
+        return f'"{digest}"'
+
+    def get_conditional_response(self, handler, request, *args, **kwargs):
+        """Ответ 304 при совпадении ETag, иначе ответ обработчика с ETag."""
+        etag = self.get_etag(request)
+        if_none_match = parse_etags(
+            request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if etag in {tag.removeprefix('W/') for tag in if_none_match}:
+            response = HttpResponseNotModified()
+        else:
+            response = handler(request, *args, **kwargs)
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        if self.etag_per_user:
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        """Список с поддержкой If-None-Match."""
+        return self.get_conditional_response(
+            super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        """Объект с поддержкой If-None-Match."""
+        return self.get_conditional_response(
+            super().retrieve, request, *args, **kwargs)
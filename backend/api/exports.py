@@ -0,0 +1,149 @@
+"""Фоновая выгрузка списка покупок в файл."""
+
+import hashlib
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+
+from django.core.files.base import ContentFile  # type: ignore
+from django.db import transaction  # type: ignore
+from django.db.models import Q  # type: ignore
+from django.utils import timezone  # type: ignore
+
+from users.models import ExportStatus, ShoppingListExport
+from .shopping_list import SHOPPING_LIST_RENDERERS, get_shopping_list
+
+RENDERERS = {renderer.format: renderer for renderer in SHOPPING_LIST_RENDERERS}
+EXPORT_FORMATS = tuple(RENDERERS)
+DEFAULT_EXPORT_FORMAT: str = 'pdf'
+EXPORT_DIRECTORY: str = 'shopping_lists'
+STALE_AFTER = timedelta(minutes=10)
+
+storage = ShoppingListExport._meta.get_field('file').storage
+
+
+def get_rows(user_id):
+    """Строки сводного списка покупок пользователя."""
+    return list(get_shopping_list(user_id))
+
+
+def get_cart_hash(rows):
+    """Хэш содержимого списка покупок."""
+    return hashlib.sha256(json.dumps(
+        rows, ensure_ascii=False, sort_keys=True).encode()).hexdigest()
+
+
+def get_export_path(cart_hash, export_format):
+    """Путь файла в закрытом хранилище: адресация по содержимому."""
+    return f'{EXPORT_DIRECTORY}/{cart_hash}.{export_format}'
+
+
+def render_document(export_format, rows):
+    """Отрисовка документа. Выполняется в процессе пула, без базы."""
+    return b''.join(RENDERERS[export_format]().stream(rows))
+
+
+def create_export(user, export_format):
+    """
+    Задание на выгрузку.
+
+    Если файл для такого же списка уже есть, задание сразу готово;
+    если такое же задание пользователя еще в очереди, возвращается оно.
+    """
+    cart_hash = get_cart_hash(get_rows(user.id))
+    path = get_export_path(cart_hash, export_format)
+    if storage.exists(path):
+        return ShoppingListExport.objects.create(
+            user=user, format=export_format, cart_hash=cart_hash,
+            status=ExportStatus.DONE, file=path)
+    queued = ShoppingListExport.objects.filter(
+        user=user, format=export_format, cart_hash=cart_hash,
+        status__in=(ExportStatus.PENDING, ExportStatus.RUNNING),
+    ).first()
+    if queued:
+        return queued
+    return ShoppingListExport.objects.create(
+        user=user, format=export_format, cart_hash=cart_hash)
+
+
+def claim_jobs(limit):
+    """
+    Захват заданий из очереди.
+
+    Задания, зависшие в работе дольше STALE_AFTER (воркер остановлен),
+    возвращаются в очередь. На Postgres строки, захваченные другим
+    воркером, пропускаются.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(
+            ShoppingListExport.objects.select_for_update(skip_locked=True)
+            .filter(Q(status=ExportStatus.PENDING)
+                    | Q(status=ExportStatus.RUNNING,
+                        updated__lt=now - STALE_AFTER))
+            .order_by('created')[:limit]
+        )
+        ShoppingListExport.objects.filter(
+            pk__in=[job.pk for job in jobs],
+        ).update(status=ExportStatus.RUNNING, updated=now)
+    return jobs
+
+
+def save_document(job, rows, content):
+    """Сохранение файла, если его еще нет, и завершение задания."""
+    job.cart_hash = get_cart_hash(rows)
+    path = get_export_path(job.cart_hash, job.format)
+    if not storage.exists(path):
+        path = storage.save(path, ContentFile(content))
+    job.file = path
+    job.status = ExportStatus.DONE
+    job.save(update_fields=('cart_hash', 'file', 'status', 'updated'))
+
+
+def fail_job(job, error):
+    """Завершение задания с ошибкой."""
+    job.status = ExportStatus.FAILED
+    job.error = str(error)
+    job.save(update_fields=('status', 'error', 'updated'))
+
+
+class ExportWorker:
+    """
+    Воркер очереди выгрузок.
+
+    Задания берутся из таблицы ShoppingListExport, строки списка
+    читаются в основном процессе, а отрисовка выполняется в пуле
+    процессов, чтобы не занимать воркеры gunicorn.
+    """
+
+    def __init__(self, processes, poll_interval):
+        """Размер пула и пауза между опросами очереди."""
+        self.processes = processes
+        self.poll_interval = poll_interval
+
+    def run(self, once=False):
+        """Обработка очереди; с once=True — до ее опустошения."""
+        running = {}
+        with ProcessPoolExecutor(self.processes) as pool:
+            while True:
+                free = self.processes - len(running)
+                if free:
+                    for job in claim_jobs(free):
+                        rows = get_rows(job.user_id)
+                        future = pool.submit(
+                            render_document, job.format, rows)
+                        running[future] = (job, rows)
+                if not running:
+                    if once:
+                        return
+                    time.sleep(self.poll_interval)
+                    continue
+                done, _ = wait(running, timeout=self.poll_interval,
+                               return_when=FIRST_COMPLETED)
+                for future in done:
+                    job, rows = running.pop(future)
+                    try:
+                        save_document(job, rows, future.result())
+                    except Exception as error:
+                        fail_job(job, error)
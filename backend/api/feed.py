@@ -0,0 +1,290 @@
+"""Лента рецептов авторов, на которых подписан пользователь."""
+
+from django.conf import settings  # type: ignore
+from django.db.models import Count  # type: ignore
+from django_redis import get_redis_connection  # type: ignore
+
+from recipes.models import Recipe
+from users.membership import subscriptions
+from users.models import Subscription
+
+FEED_LENGTH: int = 1000
+FANOUT_LIMIT: int = 5000
+LOADED_MARKER: str = 'loaded'
+PULLED_AUTHORS_KEY: str = 'feed:pulled_authors'
+FEED_ORDERING = ('-pub_date', '-id')
+
+
+def get_redis():
+    """Соединение с Redis."""
+    return get_redis_connection('default')
+
+
+def get_feed_key(user_id):
+    """Ключ ленты пользователя."""
+    return f'feed:{user_id}'
+
+
+def get_score(pub_date):
+    """Вес рецепта в ленте — время публикации."""
+    return pub_date.timestamp()
+
+
+def add_to_feeds(pipe, user_ids, scores):
+    """Добавление рецептов в ленты с обрезкой до FEED_LENGTH."""
+    for user_id in user_ids:
+        key = get_feed_key(user_id)
+        pipe.zadd(key, scores)
+        pipe.zremrangebyrank(key, 0, -(FEED_LENGTH + 2))
+        pipe.expire(key, settings.CACHE_TIMEOUT)
+
+
+def get_follower_ids(author_id):
+    """Id подписчиков автора."""
+    return Subscription.objects.filter(
+        author_id=author_id).values_list('user_id', flat=True)
+
+
+def has_many_followers(author_id):
+    """Больше ли у автора подписчиков, чем FANOUT_LIMIT."""
+    return get_follower_ids(author_id)[:FANOUT_LIMIT + 1].count() > (
+        FANOUT_LIMIT)
+
+
+def load_pulled_authors(redis):
+    """
+    Загрузка помеченных авторов из базы.
+
+    Автор помечен, пока у него больше FANOUT_LIMIT подписчиков, поэтому
+    множество можно хранить ограниченное время и собирать заново.
+    """
+    author_ids = set(
+        Subscription.objects.order_by().values('author_id').annotate(
+            followers=Count('id'),
+        ).filter(
+            followers__gt=FANOUT_LIMIT,
+        ).values_list('author_id', flat=True))
+    with redis.pipeline() as pipe:
+        pipe.delete(PULLED_AUTHORS_KEY)
+        pipe.sadd(PULLED_AUTHORS_KEY, LOADED_MARKER, *author_ids)
+        pipe.expire(PULLED_AUTHORS_KEY, settings.CACHE_TIMEOUT)
+        pipe.execute()
+    return author_ids
+
+
+def get_pulled_authors(redis):
+    """Id помеченных авторов."""
+    members = {member.decode()
+               for member in redis.smembers(PULLED_AUTHORS_KEY)}
+    if LOADED_MARKER not in members:
+        return load_pulled_authors(redis)
+    members.discard(LOADED_MARKER)
+    return {int(author_id) for author_id in members}
+
+
+def is_pulled(redis, author_id):
+    """Подмешиваются ли рецепты автора при чтении."""
+    loaded, pulled = redis.smismember(
+        PULLED_AUTHORS_KEY, (LOADED_MARKER, author_id))
+    if not loaded:
+        return author_id in load_pulled_authors(redis)
+    return bool(pulled)
+
+
+def mark_pulled(redis, author_id):
+    """
+    Пометка автора, у которого стало больше FANOUT_LIMIT подписчиков.
+
+    Его рецепты убираются из лент подписчиков: дальше они подмешиваются
+    при чтении и не должны считаться дважды.
+    """
+    redis.sadd(PULLED_AUTHORS_KEY, author_id)
+    recipe_ids = list(Recipe.objects.filter(
+        author_id=author_id,
+    ).order_by(*FEED_ORDERING).values_list('id', flat=True)[:FEED_LENGTH])
+    if not recipe_ids:
+        return
+    with redis.pipeline(transaction=False) as pipe:
+        for user_id in get_follower_ids(author_id).iterator():
+            pipe.zrem(get_feed_key(user_id), *recipe_ids)
+        pipe.execute()
+
+
+def unmark_pulled(redis, author_id):
+    """
+    Снятие пометки, когда подписчиков стало не больше FANOUT_LIMIT.
+
+    Ленты подписчиков удаляются и соберутся из базы уже с рецептами
+    автора.
+    """
+    with redis.pipeline(transaction=False) as pipe:
+        pipe.srem(PULLED_AUTHORS_KEY, author_id)
+        for user_id in get_follower_ids(author_id).iterator():
+            pipe.delete(get_feed_key(user_id))
+        pipe.execute()
+
+
+def get_followers(redis, author_id):
+    """
+    Подписчики автора или None, если их больше FANOUT_LIMIT.
+
+    Рецепты такого автора не рассылаются, а подмешиваются в ленту при
+    чтении; непомеченный автор помечается.
+    """
+    if is_pulled(redis, author_id):
+        return None
+    followers = list(get_follower_ids(author_id)[:FANOUT_LIMIT + 1])
+    if len(followers) > FANOUT_LIMIT:
+        mark_pulled(redis, author_id)
+        return None
+    return followers
+
+
+def push_recipes(recipes):
+    """Рассылка новых рецептов в ленты подписчиков их авторов."""
+    redis = get_redis()
+    scores_by_author = {}
+    for recipe in recipes:
+        scores_by_author.setdefault(recipe.author_id, {})[recipe.pk] = (
+            get_score(recipe.pub_date))
+    with redis.pipeline(transaction=False) as pipe:
+        for author_id, scores in scores_by_author.items():
+            followers = get_followers(redis, author_id)
+            if followers:
+                add_to_feeds(pipe, followers, scores)
+        pipe.execute()
+
+
+def follow(user_id, author_id):
+    """
+    Дополнение загруженной ленты рецептами нового автора.
+
+    Незагруженная лента соберется из базы при чтении, рецепты
+    помеченных авторов подмешиваются при чтении. Автор помечается,
+    если с этой подпиской у него стало больше FANOUT_LIMIT подписчиков.
+    """
+    redis = get_redis()
+    if is_pulled(redis, author_id):
+        return
+    if has_many_followers(author_id):
+        mark_pulled(redis, author_id)
+        return
+    if redis.zscore(get_feed_key(user_id), LOADED_MARKER) is None:
+        return
+    scores = {
+        recipe_id: get_score(pub_date)
+        for recipe_id, pub_date in Recipe.objects.filter(
+            author_id=author_id,
+        ).order_by(*FEED_ORDERING).values_list(
+            'id', 'pub_date')[:FEED_LENGTH]
+    }
+    if scores:
+        with redis.pipeline(transaction=False) as pipe:
+            add_to_feeds(pipe, (user_id,), scores)
+            pipe.execute()
+
+
+def unfollow(user_id, author_id):
+    """
+    Удаление рецептов автора из ленты пользователя.
+
+    С автора снимается пометка, если подписчиков стало не больше
+    FANOUT_LIMIT.
+    """
+    redis = get_redis()
+    if is_pulled(redis, author_id) and not has_many_followers(author_id):
+        unmark_pulled(redis, author_id)
+    recipe_ids = list(Recipe.objects.filter(
+        author_id=author_id).values_list('id', flat=True))
+    if recipe_ids:
+        redis.zrem(get_feed_key(user_id), *recipe_ids)
+
+
+class Timeline:
+    """
+    Лента пользователя как последовательность для Paginator.
+
+    Id рецептов хранятся в сортированном множестве Redis по времени
+    публикации; метка LOADED_MARKER с весом +inf отличает загруженную
+    ленту от отсутствующей. Рецепты авторов с большим числом подписчиков
+    читаются из базы и сливаются с лентой. Страница стоит одного
+    диапазона множества и одного запроса рецептов по id.
+    """
+
+    def __init__(self, user_id, recipes):
+        """Пользователь и выборка, из которой берутся рецепты страницы."""
+        self.user_id = user_id
+        self.recipes = recipes
+        self.key = get_feed_key(user_id)
+        self.redis = get_redis()
+        self.pulled_authors = (subscriptions.members(user_id)
+                               & get_pulled_authors(self.redis))
+        self.load()
+
+    def load(self):
+        """Сборка ленты из базы, если ее нет в Redis."""
+        if self.redis.zscore(self.key, LOADED_MARKER) is not None:
+            return
+        scores = {
+            recipe_id: get_score(pub_date)
+            for recipe_id, pub_date in Recipe.objects.filter(
+                author__following__user_id=self.user_id,
+            ).exclude(
+                author_id__in=self.pulled_authors,
+            ).order_by(*FEED_ORDERING).values_list(
+                'id', 'pub_date')[:FEED_LENGTH]
+        }
+        scores[LOADED_MARKER] = float('inf')
+        with self.redis.pipeline() as pipe:
+            pipe.delete(self.key)
+            pipe.zadd(self.key, scores)
+            pipe.expire(self.key, settings.CACHE_TIMEOUT)
+            pipe.execute()
+
+    def get_pulled_recipes(self):
+        """Рецепты авторов, которые подмешиваются при чтении."""
+        return Recipe.objects.filter(author_id__in=self.pulled_authors)
+
+    def count(self):
+        """Число рецептов в ленте."""
+        count = self.redis.zcard(self.key) - 1
+        if self.pulled_authors:
+            count += self.get_pulled_recipes().count()
+        return count
+
+    def get_entries(self, start, stop):
+        """Пары (id, вес) позиций ленты с start по stop."""
+        if not self.pulled_authors:
+            return [
+                (int(recipe_id), score)
+                for recipe_id, score in self.redis.zrevrangebyscore(
+                    self.key, '(inf', '-inf', start=start,
+                    num=stop - start, withscores=True)
+            ]
+        entries = {
+            int(recipe_id): score
+            for recipe_id, score in self.redis.zrevrangebyscore(
+                self.key, '(inf', '-inf', start=0, num=stop,
+                withscores=True)
+        }
+        entries.update(
+            (recipe_id, get_score(pub_date))
+            for recipe_id, pub_date in self.get_pulled_recipes().order_by(
+                *FEED_ORDERING).values_list('id', 'pub_date')[:stop])
+        return sorted(entries.items(),
+                      key=lambda entry: (-entry[1], -entry[0]))[start:stop]
+
+    def __getitem__(self, page):
+        """
+        Рецепты страницы ленты.
+
+        Удаленные рецепты пропускаются и убираются из ленты.
+        """
+        ids = [recipe_id for recipe_id, _ in self.get_entries(
+            page.start or 0, page.stop)]
+        recipes = self.recipes.in_bulk(ids)
+        missing = [recipe_id for recipe_id in ids if recipe_id not in recipes]
+        if missing:
+            self.redis.zrem(self.key, *missing)
+        return [recipes[recipe_id] for recipe_id in ids
+                if recipe_id in recipes]
@@ -3,44 +3,63 @@
 from django_filters import rest_framework as filters  # type: ignore
 
 from recipes.models import Recipe, Tag
+from users.membership import favorites, shopping_cart
+from .recipe_search import search_recipes
 
 
 class RecipeFilter(filters.FilterSet):
     """
     Доступна фильтрация по избранному, автору, списку покупок и тегам.
 
-    Нечувствительно к регистру.
+    Нечувствительно к регистру. Параметр search — полнотекстовый поиск
+    по названию, тексту, тегам и ингредиентам с сортировкой по
+    релевантности.
     """
 
     tags = filters.ModelMultipleChoiceFilter(
         field_name='tags__slug',
         to_field_name='slug',
         queryset=Tag.objects.all(),
+        method='filter_tags',
     )
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_is_in_shopping_cart')
+    search = filters.CharFilter(method='filter_search')
 
     class Meta:
         """Настройки фильтра."""
 
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart',
+                  'search')
+
+    def filter_tags(self, queryset, name, tags):
+        """Фильтрация по массиву id тегов, без JOIN."""
+        if not tags:
+            return queryset
+        return queryset.with_any_tags(tags)
 
     def filter_is_favorited(self, queryset, name, value):
         """Фильтрация по флагу избранное."""
         user = self.request.user
         if not user.is_authenticated:
             return queryset.none()
+        recipe_ids = favorites.members(user.id)
         if not value:
-            return queryset.exclude(favorites__in=(user,))
-        return queryset.filter(favorites__in=(user,))
+            return queryset.exclude(pk__in=recipe_ids)
+        return queryset.filter(pk__in=recipe_ids)
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
         """Фильтрация по флагу списка покупок."""
         user = self.request.user
         if not user.is_authenticated:
             return queryset.none()
+        recipe_ids = shopping_cart.members(user.id)
         if not value:
-            return queryset.exclude(shopping_cart__in=(user,))
-        return queryset.filter(shopping_cart__in=(user,))
+            return queryset.exclude(pk__in=recipe_ids)
+        return queryset.filter(pk__in=recipe_ids)
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск."""
+        return search_recipes(queryset, value)
@@ -0,0 +1,263 @@
+"""Индекс ингредиентов в памяти для поиска по названию."""
+
+import math
+import re
+from bisect import bisect_left, bisect_right
+from collections import Counter
+
+from django.contrib.postgres.search import TrigramSimilarity  # type: ignore
+from django.db import connection  # type: ignore
+from django.db.models import Case, IntegerField, Q, Value, When  # type: ignore
+
+from recipes.models import Ingredient
+from .drf_cache import get_cache_version
+
+MAX_CHAR: str = chr(0x10FFFF)
+SEARCH_LIMIT: int = 20
+SIMILARITY_THRESHOLD: float = 0.3
+PREFIX_RANK: int = 0
+WORD_START_RANK: int = 1
+SUBSTRING_RANK: int = 2
+SIMILARITY_RANK: int = 3
+
+WORD_PATTERN = re.compile(r'[^\W_]+')
+
+
+def get_trigrams(text):
+    """Триграммы строки по правилам pg_trgm."""
+    trigrams = set()
+    for word in WORD_PATTERN.findall(text.casefold()):
+        padded = f'  {word} '
+        trigrams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return trigrams
+
+
+class IngredientSnapshot:
+    """Неизменяемый снимок индекса для одной версии ингредиентов."""
+
+    def __init__(self, version, ingredients):
+        """
+        Построение индекса.
+
+        ingredients — словари в порядке сортировки базы данных,
+        позиция в этом порядке служит идентификатором записи.
+        """
+        self.version = version
+        self.ingredients = tuple(ingredients)
+        self.names = tuple(
+            ingredient['name'].casefold() for ingredient in self.ingredients)
+        prefixes = sorted(
+            (name, position) for position, name in enumerate(self.names))
+        self.prefix_keys = tuple(name for name, _ in prefixes)
+        self.prefix_positions = tuple(position for _, position in prefixes)
+        word_starts = sorted(
+            (name[match.start():], position)
+            for position, name in enumerate(self.names)
+            for match in WORD_PATTERN.finditer(name)
+            if match.start()
+        )
+        self.word_start_keys = tuple(key for key, _ in word_starts)
+        self.word_start_positions = tuple(
+            position for _, position in word_starts)
+        postings = {}
+        self.trigram_counts = []
+        for position, name in enumerate(self.names):
+            trigrams = get_trigrams(name)
+            self.trigram_counts.append(len(trigrams))
+            for trigram in trigrams:
+                postings.setdefault(trigram, []).append(position)
+        self.postings = {
+            trigram: tuple(positions)
+            for trigram, positions in postings.items()
+        }
+
+    @staticmethod
+    def get_range(keys, prefix):
+        """Границы ключей, начинающихся с prefix."""
+        start = bisect_left(keys, prefix)
+        return start, bisect_right(keys, prefix + MAX_CHAR, lo=start)
+
+    def prefix_search(self, prefix):
+        """Ингредиенты, название которых начинается с prefix."""
+        start, end = self.get_range(self.prefix_keys, prefix.casefold())
+        return [self.ingredients[position] for position in
+                sorted(self.prefix_positions[start:end])]
+
+    def contains(self, trigram, position):
+        """Есть ли триграмма в названии с данной позицией."""
+        positions = self.postings.get(trigram, ())
+        index = bisect_left(positions, position)
+        return index < len(positions) and positions[index] == position
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """
+        Ранжированный поиск.
+
+        Сначала совпадения с начала названия, затем с начала слова,
+        затем по подстроке, затем по сходству триграмм. Следующий
+        уровень не вычисляется, если результатов уже достаточно.
+        """
+        query = query.casefold().strip()
+        if not query:
+            return []
+        found = []
+        seen = set()
+
+        def add(positions):
+            for position in positions:
+                if position not in seen and len(found) < limit:
+                    seen.add(position)
+                    found.append(position)
+            return len(found) >= limit
+
+        start, end = self.get_range(self.prefix_keys, query)
+        if add(sorted(self.prefix_positions[start:end])):
+            return self.get_ingredients(found)
+        start, end = self.get_range(self.word_start_keys, query)
+        if add(sorted(self.word_start_positions[start:end])):
+            return self.get_ingredients(found)
+        query_trigrams = sorted(
+            get_trigrams(query),
+            key=lambda trigram: len(self.postings.get(trigram, ())))
+        if add(sorted(self.get_substring_matches(query, query_trigrams))):
+            return self.get_ingredients(found)
+        add(self.get_similar(query_trigrams, seen))
+        return self.get_ingredients(found)
+
+    def get_ingredients(self, positions):
+        """Ингредиенты по позициям."""
+        return [self.ingredients[position] for position in positions]
+
+    def get_substring_matches(self, query, query_trigrams):
+        """
+        Позиции названий, содержащих запрос.
+
+        Кандидаты — названия с самой редкой триграммой внутри запроса,
+        она обязательно есть в названии, содержащем запрос. У коротких
+        запросов таких триграмм нет, и названия просматриваются все.
+        """
+        inner = [trigram for trigram in query_trigrams
+                 if ' ' not in trigram and trigram in query]
+        if not inner:
+            return [position for position, name in enumerate(self.names)
+                    if query in name]
+        return [position for position in self.postings.get(inner[0], ())
+                if query in self.names[position]]
+
+    def get_similar(self, query_trigrams, seen):
+        """
+        Позиции названий по убыванию сходства триграмм, как в pg_trgm.
+
+        Сходство не ниже порога требует не менее threshold * |Q| общих
+        триграмм, поэтому кандидатов достаточно искать в самых редких
+        триграммах запроса. Остальные триграммы проверяются бинарным
+        поиском только у кандидатов, прошедших оценку сверху.
+        """
+        size = len(query_trigrams)
+        required = max(1, math.ceil(SIMILARITY_THRESHOLD * size))
+        rare_size = size - required + 1
+        rare_counts = Counter()
+        for trigram in query_trigrams[:rare_size]:
+            rare_counts.update(self.postings.get(trigram, ()))
+        common = query_trigrams[rare_size:]
+        similar = []
+        for position, shared in rare_counts.items():
+            if position in seen:
+                continue
+            names_count = self.trigram_counts[position]
+            most_shared = shared + len(common)
+            if most_shared < SIMILARITY_THRESHOLD * (
+                    size + names_count - most_shared):
+                continue
+            shared += sum(self.contains(trigram, position)
+                          for trigram in common)
+            similarity = shared / (size + names_count - shared)
+            if similarity >= SIMILARITY_THRESHOLD:
+                similar.append((-similarity, position))
+        return [position for _, position in sorted(similar)]
+
+
+class IngredientIndex:
+    """
+    Индекс ингредиентов в памяти процесса.
+
+    Строится при первом обращении и перестраивается, когда меняется
+    версия данных Ingredient. Поиск не обращается к базе.
+    """
+
+    def __init__(self):
+        """Пустой индекс."""
+        self.snapshot = IngredientSnapshot(None, ())
+
+    def refresh(self):
+        """Перестроение индекса, если ингредиенты изменились."""
+        version = get_cache_version(Ingredient)
+        if self.snapshot.version != version:
+            self.snapshot = IngredientSnapshot(
+                version,
+                Ingredient.objects.values('id', 'name', 'measurement_unit'))
+        return self.snapshot
+
+    def prefix_search(self, prefix):
+        """Ингредиенты, название которых начинается с prefix."""
+        return self.refresh().prefix_search(prefix)
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Ранжированный поиск по индексу в памяти."""
+        return self.refresh().search(query, limit)
+
+
+def has_trigram_index():
+    """Установлено ли в базе расширение pg_trgm."""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def search_in_database(query, limit=SEARCH_LIMIT):
+    """Ранжированный поиск в Postgres по GIN-индексу pg_trgm."""
+    query = query.strip()
+    if not query:
+        return []
+    escaped = re.escape(query)
+    return list(
+        Ingredient.objects
+        .filter(Q(name__iregex=escaped) | Q(name__trigram_similar=query))
+        .annotate(
+            rank=Case(
+                When(name__istartswith=query, then=Value(PREFIX_RANK)),
+                When(name__iregex=rf'\m{escaped}',
+                     then=Value(WORD_START_RANK)),
+                When(name__iregex=escaped, then=Value(SUBSTRING_RANK)),
+                default=Value(SIMILARITY_RANK),
+                output_field=IntegerField(),
+            ),
+            similarity=TrigramSimilarity('name', query),
+        )
+        .order_by('rank', '-similarity', 'name')
+        .values('id', 'name', 'measurement_unit')[:limit]
+    )
+
+
+class IngredientSearch:
+    """Поиск ингредиентов: pg_trgm при наличии, иначе индекс в памяти."""
+
+    def __init__(self, index):
+        """Индекс в памяти для запасного варианта."""
+        self.index = index
+        self.use_database = None
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        """Ранжированный поиск."""
+        if self.use_database is None:
+            self.use_database = has_trigram_index()
+        if self.use_database:
+            return search_in_database(query, limit)
+        return self.index.search(query, limit)
+
+
+ingredient_index = IngredientIndex()
+ingredient_search = IngredientSearch(ingredient_index)
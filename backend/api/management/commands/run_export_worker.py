@@ -0,0 +1,31 @@
+"""Воркер фоновой выгрузки списков покупок."""
+
+import os
+
+from django.core.management.base import BaseCommand  # type: ignore
+
+from api.exports import ExportWorker
+
+
+class Command(BaseCommand):
+    """Команда запуска воркера выгрузок."""
+
+    help = ('Обрабатывает очередь выгрузок списков покупок, отрисовывая '
+            'файлы в пуле процессов.')
+
+    def add_arguments(self, parser):
+        """Параметры команды."""
+        parser.add_argument(
+            '--processes', type=int, default=os.cpu_count() or 1,
+            help='Число процессов отрисовки.')
+        parser.add_argument(
+            '--poll-interval', type=float, default=1.0,
+            help='Пауза между опросами очереди, секунд.')
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Обработать очередь и завершиться.')
+
+    def handle(self, *args, **options):
+        """Запуск воркера."""
+        ExportWorker(options['processes'], options['poll_interval']).run(
+            once=options['once'])
@@ -1,6 +1,181 @@
-from rest_framework.pagination import PageNumberPagination  # type: ignore
+from django.conf import settings  # type: ignore
+from django.core.cache import cache  # type: ignore
+from django.core.paginator import Paginator  # type: ignore
+from django.db import connections  # type: ignore
+from django.utils.functional import cached_property  # type: ignore
+from rest_framework.pagination import (CursorPagination,  # type: ignore
+                                       PageNumberPagination)
+
+from .drf_cache import get_cache_version, get_request_signature
+
+
+class CountStrategyPaginator(Paginator):
+    """Пагинатор Django, получающий число объектов от стратегии подсчета."""
+
+    def __init__(self, object_list, per_page, count_strategy, **kwargs):
+        """Сохранение стратегии подсчета."""
+        super().__init__(object_list, per_page, **kwargs)
+        self.count_strategy = count_strategy
+
+    @cached_property
+    def count(self):
+        """Число объектов."""
+        return self.count_strategy(self.object_list)
 
 
 class LimitPagination(PageNumberPagination):
+    """
+    Постраничная пагинация с параметром limit.
+
+    Точное число объектов кэшируется по подписи фильтров запроса и
+    сбрасывается сигналами при изменении данных. Для выборок без
+    фильтров на Postgres можно включить оценку планировщика
+    (PAGINATION_ESTIMATED_COUNT).
+    """
+
     page_size = 6
     page_size_query_param = 'limit'
+    count_cache_timeout = settings.CACHE_TIMEOUT
+    use_estimated_count = settings.PAGINATION_ESTIMATED_COUNT
+    estimated_count_threshold = 10_000
+    user_query_params = ('is_favorited', 'is_in_shopping_cart')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Запрос и вьюсет нужны стратегии подсчета."""
+        self.request = request
+        self.view = view
+        return super().paginate_queryset(queryset, request, view)
+
+    def django_paginator_class(self, queryset, page_size):
+        """Пагинатор Django со стратегией подсчета этого класса."""
+        return CountStrategyPaginator(queryset, page_size, self.get_count)
+
+    def get_count(self, queryset):
+        """Число объектов: оценка планировщика или кэшированное точное."""
+        if self.use_estimated_count:
+            count = self.get_estimated_count(queryset)
+            if count is not None:
+                return count
+        return self.get_cached_count(queryset)
+
+    def is_count_per_user(self):
+        """Зависит ли число объектов от текущего пользователя."""
+        action = getattr(self.view, 'action', None)
+        return (
+            action in getattr(self.view, 'count_per_user_actions', ())
+            or any(param in self.request.query_params
+                   for param in self.user_query_params)
+        )
+
+    def get_count_cache_key(self, queryset):
+        """Ключ кэша числа объектов."""
+        model = queryset.model
+        key = f'drf:count:{model._meta.label_lower}:{get_cache_version(model)}'
+        if self.is_count_per_user():
+            user_id = self.request.user.pk
+            key = f'{key}:{user_id}:{get_cache_version(model, user_id)}'
+        signature = get_request_signature(
+            self.request, exclude=(self.page_query_param,))
+        return f'{key}:{signature}'
+
+    def get_cached_count(self, queryset):
+        """Точное число объектов из кэша или из базы."""
+        cache_key = self.get_count_cache_key(queryset)
+        count = cache.get(cache_key)
+        if count is None:
+            count = queryset.count()
+            cache.set(cache_key, count, self.count_cache_timeout)
+        return count
+
+    def get_estimated_count(self, queryset):
+        """
+        Оценка числа строк таблицы по статистике Postgres.
+
+        Только для выборок без фильтров и для больших таблиц, где
+        точный подсчет дорог, а погрешность оценки незаметна.
+        """
+        connection = connections[queryset.db]
+        if (connection.vendor != 'postgresql'
+                or queryset.query.where
+                or queryset.query.is_sliced):
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class '
+                'WHERE oid = %s::regclass',
+                (queryset.model._meta.db_table,))
+            row = cursor.fetchone()
+        if not row or row[0] < self.estimated_count_threshold:
+            return None
+        return row[0]
+
+
+class RecipeCursorPagination(CursorPagination):
+    """
+    Курсорная пагинация ленты рецептов.
+
+    Позиция задается датой публикации (индекс pub_date), поэтому
+    глубокие страницы не требуют OFFSET, а общее число не считается.
+    """
+
+    page_size = LimitPagination.page_size
+    page_size_query_param = LimitPagination.page_size_query_param
+    ordering = ('-pub_date', '-id')
+
+    def get_ordering(self, request, queryset, view):
+        """Порядок ленты фиксирован и не зависит от параметра ordering."""
+        return self.ordering
+
+
+class RecipePagination(LimitPagination):
+    """
+    Пагинация рецептов.
+
+    По умолчанию постраничная с параметрами limit и page.
+    С параметром pagination=cursor включается курсорная пагинация,
+    кроме поиска: курсор задает порядок по дате и потерял бы
+    ранжирование по релевантности, поэтому поиск всегда постраничный.
+    """
+
+    mode_query_param = 'pagination'
+    cursor_mode = 'cursor'
+    ranked_query_params = ('search',)
+
+    def __init__(self):
+        """Пагинатор курсорного режима создается по запросу."""
+        self.cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Выбор режима пагинации по параметру запроса."""
+        if (request.query_params.get(self.mode_query_param)
+                == self.cursor_mode
+                and not any(param in request.query_params
+                            for param in self.ranked_query_params)):
+            self.cursor_paginator = RecipeCursorPagination()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        """Ответ в формате выбранного режима."""
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        """Элементы управления пагинацией для browsable API."""
+        if self.cursor_paginator:
+            return self.cursor_paginator.to_html()
+        return super().to_html()
+
+
+class FeedPagination(PageNumberPagination):
+    """
+    Пагинация ленты подписок с параметрами limit и page.
+
+    Число объектов и страница берутся из ленты в Redis, поэтому кэш
+    подсчета LimitPagination не нужен.
+    """
+
+    page_size = LimitPagination.page_size
+    page_size_query_param = LimitPagination.page_size_query_param
@@ -0,0 +1,133 @@
+"""Полнотекстовый поиск рецептов."""
+
+from bisect import bisect_left, bisect_right
+
+from django.contrib.postgres.search import (SearchQuery,  # type: ignore
+                                            SearchRank)
+from django.db import connections  # type: ignore
+from django.db.models import Case, F, FloatField, Value, When  # type: ignore
+
+from recipes.constants import SEARCH_CONFIG
+from recipes.models import Recipe
+from .drf_cache import get_cache_version
+from .ingredient_index import MAX_CHAR, WORD_PATTERN
+
+SEARCH_WEIGHTS = (
+    ('name', 1.0),
+    ('search_document', 0.4),
+    ('text', 0.2),
+)
+SEARCH_ORDERING = ('-search_rank', '-pub_date', '-id')
+
+
+class RecipeSearchSnapshot:
+    """Инвертированный индекс документов рецептов одной версии данных."""
+
+    def __init__(self, version, recipes):
+        """Построение индекса: слово -> {id рецепта: вес}."""
+        self.version = version
+        postings = {}
+        for recipe in recipes:
+            for field, weight in SEARCH_WEIGHTS:
+                for term in set(WORD_PATTERN.findall(
+                        recipe[field].casefold())):
+                    weights = postings.setdefault(term, {})
+                    weights[recipe['id']] = (
+                        weights.get(recipe['id'], 0) + weight)
+        self.postings = postings
+        self.terms = tuple(sorted(postings))
+
+    def get_term_scores(self, token):
+        """Лучший вес слов, начинающихся с token, по рецептам."""
+        start = bisect_left(self.terms, token)
+        end = bisect_right(self.terms, token + MAX_CHAR, lo=start)
+        scores = {}
+        for term in self.terms[start:end]:
+            for recipe_id, weight in self.postings[term].items():
+                scores[recipe_id] = max(scores.get(recipe_id, 0), weight)
+        return scores
+
+    def search(self, query):
+        """
+        Релевантность рецептов, содержащих все слова запроса.
+
+        Слово запроса совпадает с любым словом документа, которое с него
+        начинается, — грубая замена морфологии Postgres.
+        """
+        tokens = set(WORD_PATTERN.findall(query.casefold()))
+        if not tokens:
+            return {}
+        scores = None
+        for token in sorted(tokens, key=len, reverse=True):
+            term_scores = self.get_term_scores(token)
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {recipe_id: score + term_scores[recipe_id]
+                          for recipe_id, score in scores.items()
+                          if recipe_id in term_scores}
+            if not scores:
+                return {}
+        return scores
+
+
+class RecipeSearchIndex:
+    """
+    Индекс документов рецептов в памяти процесса.
+
+    Запасной вариант для баз без полнотекстового поиска (SQLite в
+    тестах). Перестраивается, когда меняется версия данных Recipe.
+    """
+
+    def __init__(self):
+        """Пустой индекс."""
+        self.snapshot = RecipeSearchSnapshot(None, ())
+
+    def refresh(self):
+        """Перестроение индекса, если рецепты изменились."""
+        version = get_cache_version(Recipe)
+        if self.snapshot.version != version:
+            self.snapshot = RecipeSearchSnapshot(
+                version,
+                Recipe.objects.order_by().values(
+                    'id', *(field for field, _ in SEARCH_WEIGHTS)))
+        return self.snapshot
+
+    def search(self, query):
+        """Релевантность рецептов по запросу."""
+        return self.refresh().search(query)
+
+
+def search_in_database(queryset, query):
+    """Поиск в Postgres по GIN-индексу поискового вектора."""
+    search_query = SearchQuery(query, config=SEARCH_CONFIG,
+                               search_type='websearch')
+    return queryset.filter(search_vector=search_query).annotate(
+        search_rank=SearchRank(F('search_vector'), search_query),
+    ).order_by(*SEARCH_ORDERING)
+
+
+def search_in_index(queryset, query):
+    """Поиск по индексу в памяти с ранжированием в запросе."""
+    scores = recipe_search_index.search(query)
+    if not scores:
+        return queryset.none()
+    return queryset.filter(pk__in=scores).annotate(
+        search_rank=Case(
+            *(When(pk=recipe_id, then=Value(score))
+              for recipe_id, score in scores.items()),
+            output_field=FloatField(),
+        ),
+    ).order_by(*SEARCH_ORDERING)
+
+
+def search_recipes(queryset, query):
+    """Рецепты выборки, подходящие под запрос, по убыванию релевантности."""
+    if not query.strip():
+        return queryset
+    if connections[queryset.db].vendor == 'postgresql':
+        return search_in_database(queryset, query)
+    return search_in_index(queryset, query)
+
+
+recipe_search_index = RecipeSearchIndex()
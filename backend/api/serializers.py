@@ -3,15 +3,34 @@
 import base64
 
 from rest_framework import serializers  # type: ignore
+from rest_framework.settings import api_settings  # type: ignore
 from django.core.files.base import ContentFile  # type: ignore
 from django.contrib.auth import get_user_model  # type: ignore
-from django.shortcuts import get_object_or_404  # type: ignore
+from django.db import connection, transaction  # type: ignore
+from django.db.models import TextField, Value  # type: ignore
+from django.http import Http404  # type: ignore
 
 from recipes.models import Tag, Recipe, Ingredient, RecipeIngredient
-from users.models import Favorite, ShoppingCart
+from recipes.querysets import get_search_document, get_search_vector
+from users.membership import favorites, shopping_cart, subscriptions
+from users.models import ShoppingListExport
+from users.shopping_list import change_recipe_amounts
+from . import feed
+from .bulk import MAX_BULK_RECIPES
+from .catalogue import ingredient_catalogue, tag_catalogue
+from .drf_cache import bump_cache_version
+from .upserts import add_member
+from .exports import DEFAULT_EXPORT_FORMAT, EXPORT_FORMATS
 
 User = get_user_model()
 
+SUBSCRIPTION_USER_FIELDS = ('email',
+                            'id',
+                            'username',
+                            'first_name',
+                            'last_name',
+                            'avatar')
+
 
 class TagSerializer(serializers.ModelSerializer):
     """Сериализатор тегов."""
@@ -60,33 +79,20 @@ class IngredientWriteSerializer(serializers.Serializer):
 class IngredientInRecipeReadSerializer(serializers.ModelSerializer):
     """Сериализатор ингредиентов при чтении рецепта."""
 
-    amount = serializers.SerializerMethodField()
+    id = serializers.ReadOnlyField(source='ingredient.id')
+    name = serializers.ReadOnlyField(source='ingredient.name')
+    measurement_unit = serializers.ReadOnlyField(
+        source='ingredient.measurement_unit')
 
     class Meta:
         """Настройки сериализатора."""
 
-        model = Ingredient
+        model = RecipeIngredient
         fields = ('id',
                   'name',
                   'measurement_unit',
                   'amount')
 
-    def get_amount(self, ingredient):
-        """Поле, количество ингредиента."""
-        request = self.context.get('request')
-        if not request:
-            raise serializers.ValidationError('15. Нет данных запроса')
-        recipe_id = self.context.get('recipe_id')
-        try:
-            return RecipeIngredient.objects.get(
-                recipe__id=recipe_id,
-                ingredient=ingredient,
-            ).amount
-        except RecipeIngredient.DoesNotExist as err:
-            raise serializers.ValidationError(
-                f'Не найден ингредиент {ingredient.id} рецепта {recipe_id}'
-                ) from err
-
 
 class UserReadSerializer(serializers.ModelSerializer):
     """Сериализатор пользователя."""
@@ -112,11 +118,22 @@ class UserReadSerializer(serializers.ModelSerializer):
         if not request:
             raise serializers.ValidationError('1. Нет данных запроса')
         user = request.user
-        if user.is_authenticated:
-            username = user_data.username
-            return user.subscriptions.filter(username=username).exists()
+        if user.is_authenticated and not self.context.get('shared'):
+            return user_data.id in self.get_subscription_ids(request)
         return False
 
+    def get_subscription_ids(self, request):
+        """Id авторов, на которых подписан текущий пользователь.
+
+        Загружаются один раз за запрос и хранятся в объекте запроса.
+        """
+        subscription_ids = getattr(request, 'subscription_ids', None)
+        if subscription_ids is None:
+            subscription_ids = frozenset(
+                subscriptions.members(request.user.id))
+            request.subscription_ids = subscription_ids
+        return subscription_ids
+
 
 class RecipeReadSerializer(serializers.ModelSerializer):
     """Сериализатор рецептов на чтение."""
@@ -146,10 +163,34 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     def get_ingredients(self, recipe):
         """Поле, ингредиенты рецепта."""
         return IngredientInRecipeReadSerializer(
-            recipe.ingredients.all(),
+            recipe.recipe_ingredients.all(),
             many=True,
-            context={'recipe_id': recipe.id,
-                     'request': self.context.get('request')}).data
+            context=self.context).data
+
+
+class RecipeListWriteSerializer(serializers.ListSerializer):
+    """Пакетная запись рецептов, например при импорте."""
+
+    def validate(self, attrs):
+        """Названия рецептов в пакете не должны повторяться."""
+        names = [item['name'] for item in attrs]
+        if len(names) != len(set(names)):
+            raise serializers.ValidationError(
+                'Названия рецептов не должны повторяться.')
+        return attrs
+
+    def create(self, validated_data):
+        """Создание всех рецептов пакета одной транзакцией."""
+        return self.child.create_recipes(validated_data)
+
+    def to_representation(self, data):
+        """Представление рецептов, прочитанных одним запросом."""
+        request = self.context.get('request')
+        recipes = Recipe.objects.annotate_fields(request.user).in_bulk(
+            [recipe.pk for recipe in data])
+        return RecipeReadSerializer(
+            [recipes[recipe.pk] for recipe in data],
+            many=True, context=self.context).data
 
 
 class RecipeWriteSerializer(serializers.ModelSerializer):
@@ -172,6 +213,7 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                   'name',
                   'text',
                   'cooking_time')
+        list_serializer_class = RecipeListWriteSerializer
 
     def validate(self, data):
         request = self.context.get('request')
@@ -188,46 +230,42 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         return data
 
     def validate_tags(self, tags):
-        """Валидация тегов."""
-        if not tags:
-            raise serializers.ValidationError(
-                'Не указаны теги.')
-        len_set_tags = len(set(tags))
-        if len(tags) != len_set_tags:
+        """
+        Валидация тегов.
+
+        Пустой список отклоняет само поле, существование id проверяется
+        по справочнику в памяти, без запросов к базе.
+        """
+        if len(tags) != len(set(tags)):
             raise serializers.ValidationError(
                 'Теги не должны повторяться.')
-        tag_objects = Tag.objects.filter(id__in=tags).order_by()
-        if not tag_objects.exists() or tag_objects.count() != len_set_tags:
+        if tag_catalogue.get_missing(tags):
             raise serializers.ValidationError(
                 'Не все указанные теги существуют.')
         return tags
 
     def validate_ingredients(self, ingredients):
-        """Валидация ингредиентов."""
-        if not ingredients:
-            raise serializers.ValidationError(
-                'Не указаны ингредиенты.')
+        """Валидация ингредиентов по справочнику в памяти."""
         ingredient_ids = [ingredient.get('id') for ingredient in ingredients]
         if len(ingredients) != len(set(ingredient_ids)):
             raise serializers.ValidationError(
                 'Ингредиенты не должны повторяться.')
-        ingredient_objects = Ingredient.objects.filter(
-            id__in=ingredient_ids).order_by()
-        if (not ingredient_objects.exists()
-           or len(ingredients) != ingredient_objects.count()):
+        if ingredient_catalogue.get_missing(ingredient_ids):
             raise serializers.ValidationError(
                 'Не все указанные ингредиенты существуют.')
         return ingredients
 
-    def create_recipe_ingredients(self, recipe, ingredients):
-        """Создание ингредиентов рецепта."""
+    def create_recipe_ingredients(self, recipe_ingredients):
+        """Создание ингредиентов рецептов: пары (рецепт, ингредиенты)."""
         try:
             RecipeIngredient.objects.bulk_create((
                 RecipeIngredient(
                     ingredient_id=ingredient.get('id'),
                     amount=ingredient.get('amount'),
                     recipe=recipe,
-                ) for ingredient in ingredients
+                )
+                for recipe, ingredients in recipe_ingredients
+                for ingredient in ingredients
             ))
         except Exception as err:
             raise serializers.ValidationError(
@@ -242,35 +280,154 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
             recipe_id //= 23
         return ''.join((str(digit) for digit in number))
 
+    def insert_recipes(self, recipes):
+        """
+        Вставка рецептов вместе с короткими ссылками.
+
+        На Postgres id берутся из последовательности заранее, и все
+        рецепты вставляются одним INSERT уже с короткой ссылкой;
+        bulk_create не отправляет post_save, поэтому версия кэша
+        меняется здесь. На других базах рецепт вставляется save(),
+        а ссылка дописывается вторым UPDATE.
+        """
+        ids = Recipe.objects.allocate_ids(len(recipes))
+        if ids is None:
+            for recipe in recipes:
+                recipe.save()
+                recipe.short_url = self.convert_to_short_link(recipe.pk)
+                Recipe.objects.filter(pk=recipe.pk).update(
+                    short_url=recipe.short_url)
+            return
+        for recipe, recipe_id in zip(recipes, ids):
+            recipe.pk = recipe_id
+            recipe.short_url = self.convert_to_short_link(recipe_id)
+        Recipe.objects.bulk_create(recipes)
+        transaction.on_commit(lambda: bump_cache_version(Recipe))
+
+    def create_recipes(self, items):
+        """
+        Создание рецептов одной транзакцией.
+
+        Маска тегов и поисковый документ считаются до вставки; рецепты,
+        связи с тегами и ингредиенты записываются тремя запросами на
+        весь пакет, без сигналов m2m_changed. После фиксации рецепты
+        рассылаются в ленты подписчиков.
+        """
+        author = self.context.get('request').user
+        recipes = []
+        for data in items:
+            data = dict(data)
+            tags = data.pop('tags')
+            ingredients = data.pop('ingredients')
+            recipe = Recipe(author=author, **data)
+            self.set_denormalized_fields(recipe, tags, ingredients)
+            recipes.append((recipe, tags, ingredients))
+        through = Recipe.tags.through
+        with transaction.atomic():
+            self.insert_recipes([recipe for recipe, _, _ in recipes])
+            through.objects.bulk_create(
+                through(recipe=recipe, tag_id=tag_id)
+                for recipe, tags, _ in recipes for tag_id in tags)
+            self.create_recipe_ingredients(
+                (recipe, ingredients) for recipe, _, ingredients in recipes)
+            created = [recipe for recipe, _, _ in recipes]
+            transaction.on_commit(lambda: feed.push_recipes(created))
+        for recipe in created:
+            self.clear_search_vector(recipe)
+        return created
+
     def create(self, validated_data):
         """Создание рецепта."""
-        ingredients = validated_data.pop('ingredients')
-        tags = validated_data.pop('tags')
-        recipe = Recipe.objects.create(
-            author=self.context.get('request').user,
-            **validated_data)
-        recipe.short_url = self.convert_to_short_link(recipe.id)
-        recipe.tags.set(tags)
-        self.create_recipe_ingredients(recipe, ingredients)
-        recipe.save()
-        return recipe
+        return self.create_recipes((validated_data,))[0]
+
+    def update_recipe_tags(self, recipe, tags):
+        """Удаление и добавление только изменившихся связей с тегами."""
+        old_tags = {tag.pk for tag in recipe.tags.all()}
+        new_tags = set(tags)
+        through = Recipe.tags.through
+        if old_tags - new_tags:
+            through.objects.filter(
+                recipe=recipe, tag_id__in=old_tags - new_tags).delete()
+        through.objects.bulk_create(
+            through(recipe=recipe, tag_id=tag_id)
+            for tag_id in new_tags - old_tags)
+
+    def update_recipe_ingredients(self, recipe, ingredients):
+        """
+        Изменение только отличающихся строк ингредиентов рецепта.
+
+        Новые строки вставляются одним bulk_create, измененные количества
+        пишутся одним bulk_update, лишние строки удаляются delete().
+        Разница количеств переносится в сводные списки покупок.
+        """
+        old_rows = {row.ingredient_id: row
+                    for row in recipe.recipe_ingredients.all()}
+        old_amounts = {ingredient_id: row.amount
+                       for ingredient_id, row in old_rows.items()}
+        new_amounts = {ingredient['id']: ingredient['amount']
+                       for ingredient in ingredients}
+        changed_rows = []
+        for ingredient_id, row in old_rows.items():
+            amount = new_amounts.get(ingredient_id)
+            if amount is not None and amount != row.amount:
+                row.amount = amount
+                changed_rows.append(row)
+        RecipeIngredient.objects.bulk_update(changed_rows, ('amount',))
+        removed_ids = old_rows.keys() - new_amounts.keys()
+        if removed_ids:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed_ids).delete()
+        self.create_recipe_ingredients((
+            (recipe, [ingredient for ingredient in ingredients
+                      if ingredient['id'] not in old_rows]),
+        ))
+        change_recipe_amounts(recipe.pk, old_amounts, new_amounts)
+
+    def set_denormalized_fields(self, recipe, tags, ingredients):
+        """Id тегов и поисковый документ рецепта для записи в save()."""
+        tag_rows = tag_catalogue.get_rows(tags).values()
+        recipe.tag_ids = sorted(row['id'] for row in tag_rows)
+        recipe.search_document = get_search_document(
+            (row['name'] for row in tag_rows),
+            (row['name'] for row in ingredient_catalogue.get_rows(
+                [ingredient['id'] for ingredient in ingredients]).values()),
+        )
+        if connection.vendor == 'postgresql':
+            recipe.search_vector = get_search_vector(
+                *(Value(value, output_field=TextField()) for value in (
+                    recipe.name, recipe.search_document, recipe.text)))
+
+    def clear_search_vector(self, recipe):
+        """Сброс записанного выражением вектора: поле перечитается."""
+        if connection.vendor == 'postgresql':
+            del recipe.search_vector
 
     def update(self, instance, validated_data):
-        """Обновление рецепта."""
+        """
+        Обновление рецепта.
+
+        Теги и ингредиенты меняются по разнице с текущими, маска тегов и
+        поисковый документ считаются здесь же, и строка рецепта
+        записывается одним UPDATE. Связи меняются в обход сигналов
+        m2m_changed и сигналов строк: кэш сбрасывает post_save рецепта.
+        """
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
-        instance = super().update(instance, validated_data)
-        instance.tags.clear()
-        instance.tags.set(tags)
-        instance.ingredients.clear()
-        self.create_recipe_ingredients(instance, ingredients)
-        instance.save()
+        with transaction.atomic():
+            self.update_recipe_tags(instance, tags)
+            self.update_recipe_ingredients(instance, ingredients)
+            for field, value in validated_data.items():
+                setattr(instance, field, value)
+            self.set_denormalized_fields(instance, tags, ingredients)
+            instance.save()
+        self.clear_search_vector(instance)
         return instance
 
     def to_representation(self, instance):
         """Представление рецепта."""
+        request = self.context.get('request')
         return RecipeReadSerializer(
-            instance,
+            Recipe.objects.annotate_fields(request.user).get(pk=instance.pk),
             context=self.context).data
 
 
@@ -348,6 +505,8 @@ class FavoriteCreateSerializer(serializers.Serializer):
     """Сериализатор добавления в избранное."""
 
     id = serializers.IntegerField(min_value=1)
+    membership_set = favorites
+    exists_message = 'Рецепт уже добавлен в избранное.'
 
     def get_user(self):
         """Получение пользователя из запроса."""
@@ -362,34 +521,83 @@ class FavoriteCreateSerializer(serializers.Serializer):
 
     def validate(self, data_to_validate):
         """Валидация добавления в избранное."""
-        user = self.get_user()
-        recipe_id = data_to_validate.get('id')
-        if not recipe_id:
-            raise serializers.ValidationError('Нет id рецепта.')
-        if Favorite.objects.filter(recipe__id=recipe_id,
-                                   user=user).exists():
-            raise serializers.ValidationError(
-                'Рецепт уже добавлен в избранное.')
-        recipe = get_object_or_404(Recipe, id=recipe_id)
-        data_to_validate['user'] = user
-        data_to_validate['recipe'] = recipe
+        data_to_validate['user'] = self.get_user()
         return data_to_validate
 
     def save(self):
-        """Добавление в избранное."""
-        return self.validated_data.get('user').favorites.add(
-            self.validated_data.get('recipe'))
+        """
+        Добавление в избранное одним запросом.
+
+        Существование рецепта и повторное добавление определяются по
+        результату вставки, без предварительного чтения.
+        """
+        recipe, created = add_member(
+            self.membership_set, self.validated_data['user'].id,
+            self.validated_data['id'], FavoriteSerializer.Meta.fields)
+        if recipe is None:
+            raise Http404('Рецепт не найден.')
+        if not created:
+            raise serializers.ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: [self.exists_message]})
+        self.instance = recipe
+        return recipe
 
     def to_representation(self, instance):
         return FavoriteSerializer(instance,
                                   context=self.context).data
 
 
+class BulkRecipesSerializer(serializers.Serializer):
+    """Сериализатор списка id рецептов для пакетных операций."""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_RECIPES,
+    )
+
+    def validate_recipes(self, recipes):
+        """Валидация списка id."""
+        if len(recipes) != len(set(recipes)):
+            raise serializers.ValidationError(
+                'Рецепты не должны повторяться.')
+        return recipes
+
+
+class ShoppingListExportSerializer(serializers.ModelSerializer):
+    """Сериализатор задания на выгрузку списка покупок."""
+
+    format = serializers.ChoiceField(choices=EXPORT_FORMATS,
+                                     default=DEFAULT_EXPORT_FORMAT)
+
+    class Meta:
+        """Настройки сериализатора."""
+
+        model = ShoppingListExport
+        fields = ('id', 'format', 'status', 'error', 'created')
+        read_only_fields = ('status', 'error', 'created')
+
+
+class SubscriptionListSerializer(serializers.ListSerializer):
+    """Подписки страницы: рецепты всех авторов читаются вместе."""
+
+    def to_representation(self, data):
+        """Представление авторов с рецептами, сгруппированными заранее."""
+        authors = list(data)
+        self.child.author_recipes = self.child.get_author_recipes(authors)
+        return super().to_representation(authors)
+
+
 class SubscriptionSerializer(UserReadSerializer):
-    """Сериализатор подписок."""
+    """
+    Сериализатор подписок.
+
+    Число рецептов берется из аннотации recipes_count, если она есть.
+    """
 
     recipes = serializers.SerializerMethodField()
     recipes_count = serializers.SerializerMethodField()
+    author_recipes = None
 
     class Meta:
         """Настройки сериализатора."""
@@ -404,6 +612,7 @@ class SubscriptionSerializer(UserReadSerializer):
                   'recipes',
                   'recipes_count',
                   'avatar')
+        list_serializer_class = SubscriptionListSerializer
 
     def check_recipes_limit(self, recipes_limit):
         """Проверка лимита рецептов."""
@@ -419,24 +628,43 @@ class SubscriptionSerializer(UserReadSerializer):
                 'Лимит рецептов должен быть больше 0.')
         return recipes_limit
 
-    def get_recipes(self, user):
-        """Получение рецептов пользователя."""
+    def get_author_recipes(self, authors):
+        """
+        Рецепты авторов, сгруппированные по автору.
+
+        Один запрос на всех авторов: при recipes_limit рецепты
+        ограничиваются оконной функцией по каждому автору.
+        """
         request = self.context.get('request')
         if not request:
             raise serializers.ValidationError('6. Нет данных запроса.')
-        recipes = user.recipes.all()
+        recipes = Recipe.objects.filter(author__in=authors)
         recipes_limit = request.query_params.get('recipes_limit')
         if recipes_limit:
-            recipes_limit = self.check_recipes_limit(recipes_limit)
-            recipes = recipes[:recipes_limit]
+            recipes = recipes.limit_per_author(
+                self.check_recipes_limit(recipes_limit))
+        author_recipes = {author.pk: [] for author in authors}
+        for recipe in recipes.annotate_fields(request.user).order_by(
+                '-pub_date', '-id'):
+            author_recipes[recipe.author_id].append(recipe)
+        return author_recipes
+
+    def get_recipes(self, user):
+        """Получение рецептов пользователя."""
+        author_recipes = self.author_recipes
+        if author_recipes is None or user.pk not in author_recipes:
+            author_recipes = self.get_author_recipes((user,))
         return RecipeReadSerializer(
-            recipes.annotate_fields(request.user),
+            author_recipes[user.pk],
             many=True,
             context=self.context).data
 
     def get_recipes_count(self, user):
         """Получение количества рецептов пользователя."""
-        return user.recipes.count()
+        recipes_count = getattr(user, 'recipes_count', None)
+        if recipes_count is None:
+            return user.recipes.count()
+        return recipes_count
 
 
 class SubscriptionCreateSerializer(serializers.Serializer):
@@ -453,26 +681,32 @@ class SubscriptionCreateSerializer(serializers.Serializer):
         if not user.is_authenticated:
             raise serializers.ValidationError(
                 'Пользователь не аутентифицирован.')
-        subscription_user_id = data_to_validate.get('id')
-        if not subscription_user_id:
-            raise serializers.ValidationError('Нет id пользователя.')
-        if user.id == subscription_user_id:
+        if user.id == data_to_validate['id']:
             raise serializers.ValidationError(
                 'Нельзя подписаться на самого себя.')
-        if user.subscriptions.filter(
-                id=subscription_user_id).exists():
-            raise serializers.ValidationError(
-                'Пользователь уже подписан.')
-        subscription_user = get_object_or_404(User, id=subscription_user_id)
         data_to_validate['user'] = user
-        data_to_validate['subscription_user'] = subscription_user
         return data_to_validate
 
     def save(self):
-        """Создание подписки."""
-        subscription_user = self.validated_data.get('subscription_user')
-        user = self.validated_data.get('user')
-        return user.subscriptions.add(subscription_user)
+        """
+        Создание подписки одной строкой, без обратной подписки автора.
+
+        Существование автора и повторная подписка определяются по
+        результату вставки. Рецепты автора добавляются в ленту.
+        """
+        author, created = add_member(
+            subscriptions, self.validated_data['user'].id,
+            self.validated_data['id'], SUBSCRIPTION_USER_FIELDS)
+        if author is None:
+            raise Http404('Пользователь не найден.')
+        if not created:
+            raise serializers.ValidationError(
+                {api_settings.NON_FIELD_ERRORS_KEY: [
+                    'Пользователь уже подписан.']})
+        user_id = self.validated_data['user'].id
+        transaction.on_commit(lambda: feed.follow(user_id, author.pk))
+        self.instance = author
+        return author
 
     def to_representation(self, instance):
         return SubscriptionSerializer(instance,
@@ -482,26 +716,8 @@ class SubscriptionCreateSerializer(serializers.Serializer):
 class ShoppingCreateSerializer(FavoriteCreateSerializer):
     """Сериализатор добавления в список покупок."""
 
-    def validate(self, data_to_validate):
-        """Валидация добавления в список покупок."""
-        user = self.get_user()
-        recipe_id = data_to_validate.get('id')
-        if not recipe_id:
-            raise serializers.ValidationError('Нет id рецепта.')
-        if ShoppingCart.objects.filter(
-                recipe__id=recipe_id,
-                user=user).exists():
-            raise serializers.ValidationError(
-                'Рецепт уже добавлен в список покупок.')
-        recipe = get_object_or_404(Recipe, id=recipe_id)
-        data_to_validate['user'] = user
-        data_to_validate['recipe'] = recipe
-        return data_to_validate
-
-    def save(self):
-        """Добавление рецепта в список покупок."""
-        return self.validated_data.get('user').shopping_cart.add(
-            self.validated_data.get('recipe'))
+    membership_set = shopping_cart
+    exists_message = 'Рецепт уже добавлен в список покупок.'
 
 
 class AvatarSerializer(serializers.ModelSerializer):
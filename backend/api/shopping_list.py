@@ -0,0 +1,211 @@
+"""Выгрузка списка покупок."""
+
+import csv
+import json
+import os
+from io import BytesIO
+from itertools import chain
+
+from django.conf import settings  # type: ignore
+from django.db.models import F  # type: ignore
+from reportlab.lib.pagesizes import A4  # type: ignore
+from reportlab.pdfbase import pdfmetrics  # type: ignore
+from reportlab.pdfbase.ttfonts import TTFont  # type: ignore
+from reportlab.pdfgen import canvas  # type: ignore
+from rest_framework.renderers import BaseRenderer  # type: ignore
+
+from users.models import ShoppingListItem
+
+TITLE: str = 'Список покупок.'
+EMPTY_MESSAGE: str = 'Нет ингредиентов для покупки.'
+CSV_BOM: str = '\ufeff'
+CSV_HEADER = ('Ингредиент', 'Единица измерения', 'Количество')
+PDF_FONT_NAME: str = 'ShoppingListFont'
+PDF_FALLBACK_FONT: str = 'Helvetica'
+PDF_FONT_SIZE: int = 12
+PDF_LINE_HEIGHT: int = 18
+PDF_MARGIN: int = 50
+ITERATOR_CHUNK_SIZE: int = 500
+
+
+def get_shopping_list(user):
+    """
+    Ингредиенты сводного списка покупок пользователя.
+
+    Суммы поддерживаются при изменении списка покупок и рецептов,
+    чтение — один проход по индексу (user, ingredient) без агрегации.
+    Строки читаются итератором, память не зависит от размера списка.
+    """
+    return ShoppingListItem.objects.filter(user=user).values(
+        name=F('ingredient__name'),
+        measurement_unit=F('ingredient__measurement_unit'),
+        total_amount=F('amount'),
+    ).order_by('name').iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """
+    Базовый рендерер списка покупок.
+
+    stream() отдает документ частями для StreamingHttpResponse,
+    render() используется для ответов с ошибкой.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Ответ с ошибкой в формате рендерера."""
+        if isinstance(data, dict):
+            data = ' '.join(str(value) for value in data.values())
+        return b''.join(self.stream_message(str(data)))
+
+    def stream(self, rows):
+        """Документ по строкам списка покупок."""
+        rows = iter(rows)
+        first = next(rows, None)
+        if first is None:
+            return self.stream_empty()
+        return self.stream_rows(chain((first,), rows))
+
+    def stream_empty(self):
+        """Документ для пустого списка."""
+        return self.stream_message(EMPTY_MESSAGE)
+
+    def stream_rows(self, rows):
+        """Документ со строками списка."""
+        raise NotImplementedError
+
+    def stream_message(self, text):
+        """Документ с одним сообщением."""
+        raise NotImplementedError
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в TXT."""
+
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream_rows(self, rows):
+        """Заголовок и строка на каждый ингредиент."""
+        yield f'{TITLE}\n\n'.encode()
+        for row in rows:
+            yield (f'{row["name"]}:  {row["measurement_unit"]} '
+                   f'— {row["total_amount"]}\n').encode()
+
+    def stream_message(self, text):
+        """Текст сообщения."""
+        yield text.encode()
+
+
+class Echo:
+    """Псевдобуфер: write() возвращает строку вместо записи."""
+
+    def write(self, value):
+        """Строка без буферизации."""
+        return value
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в CSV с BOM для табличных редакторов."""
+
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream_rows(self, rows):
+        """Строка заголовков и строка на каждый ингредиент."""
+        writer = csv.writer(Echo())
+        yield (CSV_BOM + writer.writerow(CSV_HEADER)).encode()
+        for row in rows:
+            yield writer.writerow((row['name'], row['measurement_unit'],
+                                   row['total_amount'])).encode()
+
+    def stream_message(self, text):
+        """Сообщение в единственной ячейке."""
+        yield (CSV_BOM + csv.writer(Echo()).writerow((text,))).encode()
+
+
+class JSONShoppingListRenderer(ShoppingListRenderer):
+    """Список покупок в JSON: массив объектов."""
+
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream_rows(self, rows):
+        """Массив, записываемый по одному элементу."""
+        separator = '['
+        for row in rows:
+            yield (separator + json.dumps(row, ensure_ascii=False)).encode()
+            separator = ','
+        yield b']'
+
+    def stream_empty(self):
+        """Пустой массив."""
+        yield b'[]'
+
+    def stream_message(self, text):
+        """Объект с полем detail."""
+        yield json.dumps({'detail': text}, ensure_ascii=False).encode()
+
+
+def get_pdf_font():
+    """Шрифт с кириллицей из SHOPPING_LIST_PDF_FONT, если файл есть."""
+    if PDF_FONT_NAME in pdfmetrics.getRegisteredFontNames():
+        return PDF_FONT_NAME
+    if not os.path.exists(settings.SHOPPING_LIST_PDF_FONT):
+        return PDF_FALLBACK_FONT
+    pdfmetrics.registerFont(
+        TTFont(PDF_FONT_NAME, settings.SHOPPING_LIST_PDF_FONT))
+    return PDF_FONT_NAME
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    """
+    Список покупок в PDF.
+
+    Формат требует таблицы смещений в конце файла, поэтому документ
+    отдается целиком после отрисовки. Его размер ограничен числом
+    разных ингредиентов, а не числом рецептов.
+    """
+
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+    def draw(self, lines):
+        """PDF со строками текста с переносом на новые страницы."""
+        buffer = BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        font = get_pdf_font()
+        _, height = A4
+        y = height - PDF_MARGIN
+        pdf.setFont(font, PDF_FONT_SIZE)
+        for line in lines:
+            if y < PDF_MARGIN:
+                pdf.showPage()
+                pdf.setFont(font, PDF_FONT_SIZE)
+                y = height - PDF_MARGIN
+            pdf.drawString(PDF_MARGIN, y, line)
+            y -= PDF_LINE_HEIGHT
+        pdf.save()
+        return buffer.getvalue()
+
+    def stream_rows(self, rows):
+        """Заголовок и строка на каждый ингредиент."""
+        yield self.draw(chain(
+            (TITLE, ''),
+            (f'{row["name"]}: {row["total_amount"]} '
+             f'{row["measurement_unit"]}' for row in rows),
+        ))
+
+    def stream_message(self, text):
+        """Документ с одной строкой."""
+        yield self.draw((text,))
+
+
+SHOPPING_LIST_RENDERERS = (
+    TextShoppingListRenderer,
+    CSVShoppingListRenderer,
+    JSONShoppingListRenderer,
+    PDFShoppingListRenderer,
+)
@@ -0,0 +1,137 @@
+"""Сигналы."""
+
+from functools import partial
+
+from django.contrib.auth import get_user_model  # type: ignore
+from django.db.models.signals import (m2m_changed,  # type: ignore
+                                      post_delete, post_save)
+from django.db import transaction  # type: ignore
+from django.dispatch import receiver  # type: ignore
+from rest_framework.authtoken.models import Token  # type: ignore
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from users.models import Favorite, ShoppingCart, Subscription
+from . import feed
+from .authentication import token_cache
+from .drf_cache import bump_cache_version
+
+User = get_user_model()
+
+AUTHOR_FIELDS = frozenset(
+    ('email', 'username', 'first_name', 'last_name', 'avatar'))
+
+
+def bump_on_commit(model, scope=None):
+    """
+    Смена версии после фиксации транзакции.
+
+    До фиксации другие запросы видят старые строки и сохранили бы их в
+    кэш уже под новой версией.
+    """
+    transaction.on_commit(partial(bump_cache_version, model, scope))
+
+
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_response_cache(sender, **kwargs):
+    """
+    Сброс кэша ответов при изменении тегов и ингредиентов.
+
+    Их названия входят в поисковые документы, поэтому сбрасывается и
+    кэш числа рецептов.
+    """
+    bump_on_commit(sender)
+    bump_on_commit(Recipe)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver(post_delete, sender=User)
+def invalidate_counts(sender, **kwargs):
+    """Сброс кэша числа объектов при изменении рецептов и пользователей."""
+    bump_on_commit(sender)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_cards(sender, created, update_fields, **kwargs):
+    """
+    Сброс кэша пользователей при изменении полей карточки автора.
+
+    Сохранения только других полей, например last_login при входе или
+    пароля, не сбрасывают общие страницы рецептов.
+    """
+    if created or update_fields is None or AUTHOR_FIELDS & update_fields:
+        bump_on_commit(sender)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def invalidate_recipe_ingredients(sender, **kwargs):
+    """Сброс кэша рецептов при изменении их ингредиентов."""
+    bump_on_commit(Recipe)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tag_counts(sender, action, **kwargs):
+    """Сброс кэша числа рецептов при изменении тегов рецепта."""
+    if action.startswith('post_'):
+        bump_on_commit(Recipe)
+
+
+def get_listed_model(sender):
+    """Модель списка, число объектов которого зависит от таблицы связи."""
+    return User if sender is Subscription else Recipe
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShoppingCart)
+@receiver((post_save, post_delete), sender=Subscription)
+def invalidate_user_counts(sender, instance, **kwargs):
+    """Сброс кэша числа объектов пользователя при изменении его списков."""
+    bump_on_commit(get_listed_model(sender), instance.user_id)
+
+
+@receiver(m2m_changed, sender=Favorite)
+@receiver(m2m_changed, sender=ShoppingCart)
+@receiver(m2m_changed, sender=Subscription)
+def invalidate_user_counts_m2m(sender, action, instance, reverse, pk_set,
+                               **kwargs):
+    """
+    Сброс кэша числа объектов пользователей при add/remove/clear.
+
+    Подписки симметричны, поэтому затрагивают и авторов из pk_set.
+    """
+    if not action.startswith('post_'):
+        return
+    listed_model = get_listed_model(sender)
+    symmetrical = sender is Subscription
+    if pk_set is None and (reverse or symmetrical):
+        bump_on_commit(listed_model)
+        return
+    if reverse:
+        user_ids = set(pk_set)
+    else:
+        user_ids = {instance.pk}
+    if symmetrical:
+        user_ids |= set(pk_set or ())
+    for user_id in user_ids:
+        bump_on_commit(listed_model, user_id)
+
+
+@receiver(post_save, sender=User)
+def evict_user_tokens(sender, instance, created, **kwargs):
+    """Сброс снимков пользователя при изменении, в том числе пароля."""
+    if not created:
+        token_cache.evict(*Token.objects.filter(
+            user=instance).values_list('key', flat=True))
+
+
+@receiver(post_delete, sender=Token)
+def evict_token(sender, instance, **kwargs):
+    """Сброс снимка при выходе и удалении токена."""
+    token_cache.evict(instance.key)
+
+
+@receiver(post_delete, sender=Subscription)
+def remove_from_feed(sender, instance, **kwargs):
+    """Удаление рецептов автора из ленты при отписке."""
+    transaction.on_commit(
+        lambda: feed.unfollow(instance.user_id, instance.author_id))
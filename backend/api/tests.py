@@ -0,0 +1,721 @@
+"""Тесты API."""
+
+import tempfile
+from pathlib import Path
+from unittest import mock, skipUnless
+
+from django.contrib.auth import get_user_model  # type: ignore
+from django.conf import settings  # type: ignore
+from django.core.cache import cache  # type: ignore
+from django.db import connection  # type: ignore
+from django.test import override_settings  # type: ignore
+from django.test.utils import CaptureQueriesContext  # type: ignore
+from rest_framework.test import APITestCase  # type: ignore
+
+from recipes.models import Ingredient, Recipe, RecipeIngredient, Tag
+from users import shopping_list
+from users.membership import favorites, shopping_cart, subscriptions
+from users.models import ShoppingListExport, ShoppingListItem
+from . import authentication, exports, feed
+from .drf_cache import get_cache_version
+from .ingredient_index import ingredient_index
+from .serializers import RecipeWriteSerializer
+from .upserts import add_member
+
+User = get_user_model()
+
+RECIPES_URL: str = '/api/recipes/'
+LOGIN_URL: str = '/api/auth/token/login/'
+SET_PASSWORD_URL: str = '/api/users/set_password/'
+INGREDIENTS_URL: str = '/api/ingredients/'
+BULK_SHOPPING_CART_URL: str = '/api/recipes/shopping_cart/bulk/'
+EXPORTS_URL: str = '/api/recipes/download_shopping_cart/jobs/'
+FEED_URL: str = '/api/recipes/feed/'
+USERS_URL: str = '/api/users/'
+ME_URL: str = '/api/users/me/'
+PIXEL_PNG: str = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAA'
+    'ADUlEQVR42mNkYPhfDwAChwGA60e6kgAAAABJRU5ErkJggg==')
+PAGE_SIZE: int = 6
+
+
+def get_test_caches():
+    """Кэш тестов в отдельной базе Redis, чтобы не очищать данные сайта."""
+    default = settings.CACHES['default']
+    server = default['LOCATION'].rsplit('/', 1)[0]
+    return {'default': {
+        **default, 'LOCATION': f'{server}/{settings.REDIS_TEST_DB}'}}
+
+
+def create_user(name):
+    """Пользователь с логином name и паролем password."""
+    return User.objects.create_user(
+        username=name, email=f'{name}@example.com',
+        first_name='Имя', last_name='Фамилия', password='password')
+
+
+def create_recipe(author, number=0, **kwargs):
+    """Рецепт автора; название и короткая ссылка по номеру."""
+    fields = {'name': f'Рецепт {number}', 'text': 'Текст',
+              'image': 'recipes/images/recipe.png', 'cooking_time': 10,
+              'short_url': f'r{number}', **kwargs}
+    return Recipe.objects.create(author=author, **fields)
+
+
+@override_settings(CACHES=get_test_caches())
+class ApiTestCase(APITestCase):
+    """Тест API с пустой тестовой базой Redis."""
+
+    def setUp(self):
+        """Очистка тестовой базы Redis."""
+        cache.clear()
+
+
+class RecipeListQueriesTest(ApiTestCase):
+    """Число запросов списка рецептов не зависит от числа ингредиентов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Автор, тег и ингредиенты."""
+        cls.author = create_user('author')
+        cls.reader = create_user('reader')
+        cls.tag = Tag.objects.create(name='Завтрак', slug='breakfast')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number:02}',
+                                      measurement_unit='г')
+            for number in range(12)
+        ]
+
+    def create_recipes(self, ingredients_count):
+        """Страница рецептов с заданным числом ингредиентов в каждом."""
+        Recipe.objects.all().delete()
+        for number in range(PAGE_SIZE):
+            recipe = create_recipe(self.author, number)
+            recipe.tags.add(self.tag)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=amount)
+                for amount, ingredient in enumerate(
+                    self.ingredients[:ingredients_count], start=1)
+            )
+        cache.clear()
+
+    def get_list_queries(self, ingredients_count):
+        """Число запросов и ответ списка рецептов."""
+        self.create_recipes(ingredients_count)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(RECIPES_URL, {'limit': PAGE_SIZE})
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()['results']
+
+    def assert_fixed_query_count(self):
+        """Один и двенадцать ингредиентов стоят одинаково."""
+        one_count, _ = self.get_list_queries(1)
+        many_count, results = self.get_list_queries(12)
+        self.assertEqual(many_count, one_count)
+        self.assertEqual(len(results), PAGE_SIZE)
+        for recipe in results:
+            self.assertEqual(
+                [(ingredient['name'], ingredient['amount'])
+                 for ingredient in recipe['ingredients']],
+                [(ingredient.name, amount) for amount, ingredient in
+                 enumerate(self.ingredients, start=1)],
+            )
+
+    def test_anonymous_list(self):
+        """Список для анонимного пользователя."""
+        self.assert_fixed_query_count()
+
+    def test_authenticated_list(self):
+        """Список для авторизованного пользователя."""
+        self.client.force_authenticate(self.reader)
+        self.assert_fixed_query_count()
+
+
+class AuthorCardVersionTest(ApiTestCase):
+    """Версия пользователей меняется только с карточкой автора."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Пользователь."""
+        cls.user = create_user('author')
+
+    def test_login_and_password_keep_version(self):
+        """Вход и смена пароля не сбрасывают общие страницы."""
+        version = get_cache_version(User)
+        response = self.client.post(LOGIN_URL, {
+            'email': 'author@example.com', 'password': 'password'})
+        self.assertEqual(response.status_code, 200)
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.json()["auth_token"]}')
+        response = self.client.post(SET_PASSWORD_URL, {
+            'current_password': 'password',
+            'new_password': 'new-password-123'})
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(get_cache_version(User), version)
+
+    def test_snapshot_fields_change(self):
+        """Снимок с другим набором полей не читается из Redis."""
+        response = self.client.post(LOGIN_URL, {
+            'email': 'author@example.com', 'password': 'password'})
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f'Token {response.json()["auth_token"]}')
+        self.assertEqual(self.client.get(ME_URL).status_code, 200)
+        fields = authentication.SNAPSHOT_FIELDS[::-1]
+        authentication.token_cache.entries.clear()
+        with mock.patch.multiple(
+                authentication, SNAPSHOT_FIELDS=fields,
+                SNAPSHOT_VERSION=authentication.get_snapshot_version(fields)):
+            response = self.client.get(ME_URL)
+        self.assertEqual(response.json()['username'], 'author')
+
+    def test_author_fields_bump_version(self):
+        """Изменение имени автора сбрасывает общие страницы."""
+        version = get_cache_version(User)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.first_name = 'Повар'
+            self.user.save(update_fields=('first_name',))
+        self.assertNotEqual(get_cache_version(User), version)
+
+    def test_version_changes_after_commit(self):
+        """Версия меняется только после фиксации транзакции."""
+        version = get_cache_version(Tag)
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Ужин', slug='dinner')
+            self.assertEqual(get_cache_version(Tag), version)
+        self.assertNotEqual(get_cache_version(Tag), version)
+
+
+class IngredientListTest(ApiTestCase):
+    """Поиск ингредиентов отдается с ETag и из кэша ответов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Ингредиенты."""
+        for name in ('Соль', 'Сахар', 'Морская соль', 'Молоко'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def get_names(self, params):
+        """Названия найденных ингредиентов."""
+        response = self.client.get(INGREDIENTS_URL, params)
+        self.assertEqual(response.status_code, 200)
+        return [ingredient['name'] for ingredient in response.json()]
+
+    def test_conditional_get(self):
+        """Повторный запрос с If-None-Match получает 304."""
+        for params in ({'name': 'Со'}, {'search': 'соль'}):
+            response = self.client.get(INGREDIENTS_URL, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('ETag', response)
+            response = self.client.get(
+                INGREDIENTS_URL, params,
+                HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_cached_response(self):
+        """Повторный запрос отдается из кэша ответов."""
+        self.assertEqual(self.get_names({'name': 'Мо'}),
+                         ['Молоко', 'Морская соль'])
+        with mock.patch.object(ingredient_index, 'prefix_search') as search:
+            self.assertEqual(self.get_names({'name': 'Мо'}),
+                             ['Молоко', 'Морская соль'])
+        search.assert_not_called()
+
+    def test_short_substring_search(self):
+        """Запросы из одной-двух букв находят вхождения в середине."""
+        self.assertCountEqual(self.get_names({'search': 'ол'}),
+                              ['Соль', 'Молоко', 'Морская соль'])
+        self.assertEqual(self.get_names({'search': 'х'}), ['Сахар'])
+
+
+class BulkShoppingCartTest(ApiTestCase):
+    """Пакетные изменения учитывают только свои строки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Пользователь и рецепт с ингредиентом."""
+        cls.user = create_user('buyer')
+        cls.recipe = create_recipe(cls.user)
+        cls.ingredient = Ingredient.objects.create(
+            name='Мука', measurement_unit='г')
+        RecipeIngredient.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredient, amount=5)
+
+    def setUp(self):
+        """Авторизация."""
+        super().setUp()
+        self.client.force_authenticate(self.user)
+
+    def change(self, method):
+        """Статус рецепта после пакетного изменения."""
+        response = getattr(self.client, method)(
+            BULK_SHOPPING_CART_URL, {'recipes': [self.recipe.id]},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()[0]['status']
+
+    def get_total(self):
+        """Сумма ингредиента в сводном списке покупок."""
+        item = ShoppingListItem.objects.filter(
+            user=self.user, ingredient=self.ingredient).first()
+        return item.amount if item else 0
+
+    def test_stale_set_on_add(self):
+        """Повторное добавление по устаревшему множеству не удваивает."""
+        self.assertEqual(self.change('post'), 'added')
+        shopping_cart.redis.srem(
+            shopping_cart.get_key(self.user.id), self.recipe.id)
+        self.assertEqual(self.change('post'), 'already_added')
+        self.assertEqual(self.get_total(), 5)
+        self.assertFalse(shopping_list.find_drifted((self.user.id,)))
+
+    def test_stale_set_on_remove(self):
+        """Повторное удаление по устаревшему множеству не вычитает."""
+        self.change('post')
+        self.assertEqual(self.change('delete'), 'removed')
+        shopping_cart.redis.sadd(
+            shopping_cart.get_key(self.user.id), self.recipe.id)
+        self.assertEqual(self.change('delete'), 'not_in_list')
+        self.assertEqual(self.get_total(), 0)
+        self.assertFalse(shopping_list.find_drifted((self.user.id,)))
+
+    def test_single_delete_once(self):
+        """Повторное удаление одного рецепта — 404 без вычитания."""
+        self.change('post')
+        url = f'{RECIPES_URL}{self.recipe.id}/shopping_cart/'
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        shopping_cart.redis.sadd(
+            shopping_cart.get_key(self.user.id), self.recipe.id)
+        self.assertEqual(self.client.delete(url).status_code, 404)
+        self.assertEqual(self.get_total(), 0)
+        self.assertFalse(shopping_list.find_drifted((self.user.id,)))
+
+    def test_recipe_delete_single_delta(self):
+        """Удаление рецепта вычитает его из всех списков одной дельтой."""
+        other = create_user('other')
+        self.change('post')
+        other.shopping_cart.add(self.recipe)
+        with mock.patch.object(shopping_list, 'apply_deltas',
+                               wraps=shopping_list.apply_deltas) as apply:
+            self.recipe.delete()
+        apply.assert_called_once()
+        self.assertFalse(ShoppingListItem.objects.exists())
+
+
+class ShoppingListExportTest(ApiTestCase):
+    """Готовые выгрузки не попадают в MEDIA_ROOT и видны только владельцу."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Владелец выгрузки и другой пользователь."""
+        cls.owner = create_user('owner')
+        cls.stranger = create_user('stranger')
+
+    def setUp(self):
+        """Закрытое хранилище во временном каталоге."""
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        patcher = mock.patch.object(exports.storage, 'location',
+                                    directory.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_private_file(self):
+        """Файл отдается владельцу задания и не лежит в MEDIA_ROOT."""
+        self.client.force_authenticate(self.owner)
+        response = self.client.post(EXPORTS_URL, {'format': 'txt'})
+        self.assertEqual(response.status_code, 202)
+        job = ShoppingListExport.objects.get(pk=response.json()['id'])
+        rows = exports.get_rows(self.owner.id)
+        exports.save_document(
+            job, rows, exports.render_document(job.format, rows))
+        path = Path(exports.storage.path(job.file.name))
+        self.assertTrue(path.is_file())
+        self.assertFalse(path.is_relative_to(settings.MEDIA_ROOT))
+        url = f'{EXPORTS_URL}{job.pk}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content),
+                         path.read_bytes())
+        self.client.force_authenticate(self.stranger)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get(url).status_code, 401)
+
+    def test_failed_job(self):
+        """Ошибка задания отдается как состояние, а не как ошибка 500."""
+        self.client.force_authenticate(self.owner)
+        response = self.client.post(EXPORTS_URL, {'format': 'txt'})
+        job = ShoppingListExport.objects.get(pk=response.json()['id'])
+        exports.fail_job(job, 'Диск заполнен')
+        response = self.client.get(f'{EXPORTS_URL}{job.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['status'], 'failed')
+        self.assertEqual(response.json()['error'], 'Диск заполнен')
+
+
+class RecipeUpdateTest(ApiTestCase):
+    """Правка ингредиентов рецепта."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Автор, рецепт с двумя ингредиентами в его списке покупок."""
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(name='Обед', slug='lunch')
+        cls.flour, cls.salt, cls.sugar = (
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Мука', 'Соль', 'Сахар'))
+        cls.recipe = create_recipe(cls.author, name='Хлеб')
+        cls.recipe.tags.add(cls.tag)
+        RecipeIngredient.objects.bulk_create((
+            RecipeIngredient(recipe=cls.recipe, ingredient=cls.flour,
+                             amount=500),
+            RecipeIngredient(recipe=cls.recipe, ingredient=cls.salt,
+                             amount=10),
+        ))
+
+    def setUp(self):
+        """Рецепт в списке покупок автора."""
+        super().setUp()
+        self.client.force_authenticate(self.author)
+        response = self.client.post(
+            BULK_SHOPPING_CART_URL, {'recipes': [self.recipe.id]},
+            format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_ingredients(self):
+        """Лишние строки удаляются, списки покупок пересчитываются."""
+        response = self.client.patch(
+            f'{RECIPES_URL}{self.recipe.id}/', {
+                'name': 'Хлеб', 'text': 'Текст', 'cooking_time': 10,
+                'tags': [self.tag.id],
+                'ingredients': [{'id': self.flour.id, 'amount': 400},
+                                {'id': self.sugar.id, 'amount': 20}],
+            }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            dict(self.recipe.recipe_ingredients.values_list(
+                'ingredient_id', 'amount')),
+            {self.flour.id: 400, self.sugar.id: 20})
+        self.assertEqual(
+            dict(ShoppingListItem.objects.filter(
+                user=self.author, amount__gt=0).values_list(
+                'ingredient_id', 'amount')),
+            {self.flour.id: 400, self.sugar.id: 20})
+        self.assertFalse(shopping_list.find_drifted((self.author.id,)))
+
+
+class TagFilterTest(ApiTestCase):
+    """Фильтр по тегам и синхронизация tag_ids с таблицей связи."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Теги и рецепты с ними."""
+        cls.author = create_user('author')
+        cls.tags = [Tag.objects.create(name=f'Тег {number}',
+                                       slug=f'tag{number}')
+                    for number in range(3)]
+        cls.recipes = []
+        for number, tag in enumerate(cls.tags[:2]):
+            recipe = create_recipe(cls.author, number)
+            recipe.tags.add(tag)
+            cls.recipes.append(recipe)
+
+    def get_names(self, *slugs):
+        """Названия рецептов с любым из тегов."""
+        response = self.client.get(RECIPES_URL, {'tags': slugs})
+        return [recipe['name'] for recipe in response.json()['results']]
+
+    def get_tag_ids(self, recipe):
+        """Id тегов рецепта из базы."""
+        return Recipe.objects.get(pk=recipe.pk).tag_ids
+
+    def test_filter_by_any_tag(self):
+        """Рецепт попадает в выборку по любому из своих тегов один раз."""
+        self.recipes[0].tags.add(self.tags[1])
+        self.assertEqual(self.get_names('tag0'), ['Рецепт 0'])
+        self.assertCountEqual(self.get_names('tag0', 'tag1'),
+                              ['Рецепт 0', 'Рецепт 1'])
+        self.assertEqual(self.get_names('tag2'), [])
+
+    def test_tag_side_changes(self):
+        """Изменения со стороны тега пересчитывают tag_ids рецептов."""
+        tag = self.tags[2]
+        tag.recipes.add(*self.recipes)
+        self.assertEqual(self.get_tag_ids(self.recipes[1]),
+                         sorted((self.tags[1].pk, tag.pk)))
+        tag.recipes.remove(self.recipes[1])
+        self.assertEqual(self.get_tag_ids(self.recipes[1]),
+                         [self.tags[1].pk])
+        tag.recipes.clear()
+        self.assertEqual(self.get_tag_ids(self.recipes[0]),
+                         [self.tags[0].pk])
+        self.tags[0].delete()
+        self.assertEqual(self.get_tag_ids(self.recipes[0]), [])
+
+    def test_tag_count_is_unlimited(self):
+        """Число тегов не ограничено размером маски."""
+        Tag.objects.bulk_create(
+            Tag(name=f'Новый {number}', slug=f'new{number}')
+            for number in range(64))
+        tag = Tag.objects.create(name='Еще один', slug='another')
+        self.recipes[0].tags.add(tag)
+        self.assertEqual(self.get_names('another'), ['Рецепт 0'])
+
+
+def get_statements(queries):
+    """Запросы без точек сохранения."""
+    return [query['sql'] for query in queries.captured_queries
+            if 'SAVEPOINT' not in query['sql']]
+
+
+is_postgres = connection.vendor == 'postgresql'
+postgres_only = skipUnless(is_postgres, 'Запрос только для Postgres.')
+
+
+class AddMemberTest(ApiTestCase):
+    """Добавление в избранное и подписки по результату вставки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Пользователь, автор и рецепт."""
+        cls.user = create_user('reader')
+        cls.author = create_user('author')
+        cls.recipe = create_recipe(cls.author)
+
+    def test_add_member(self):
+        """Вставка, повтор и отсутствующий объект."""
+        for membership_set, target in ((favorites, self.recipe),
+                                       (subscriptions, self.author)):
+            with self.subTest(membership_set.name):
+                member, created = add_member(
+                    membership_set, self.user.id, target.id, ('id', 'name',
+                                                              'username'))
+                self.assertTrue(created)
+                self.assertEqual(member.pk, target.pk)
+                self.assertTrue(membership_set.model.objects.filter(
+                    user=self.user, **{membership_set.object_field: target},
+                ).exists())
+                member, created = add_member(
+                    membership_set, self.user.id, target.id, ('id',))
+                self.assertEqual((member.pk, created), (target.pk, False))
+                self.assertEqual(add_member(
+                    membership_set, self.user.id, target.id + 1000, ('id',)),
+                    (None, False))
+
+    def test_favorite_endpoint(self):
+        """Ответы 200, 400 и 404 без предварительного чтения."""
+        self.client.force_authenticate(self.user)
+        url = f'{RECIPES_URL}{self.recipe.id}/favorite/'
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], self.recipe.name)
+        response = self.client.post(url)
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('non_field_errors', response.json())
+        response = self.client.post(
+            f'{RECIPES_URL}{self.recipe.id + 1000}/favorite/')
+        self.assertEqual(response.status_code, 404)
+
+    @postgres_only
+    def test_single_statement(self):
+        """На Postgres проверка, вставка и чтение — один запрос."""
+        with CaptureQueriesContext(connection) as queries:
+            member, created = add_member(
+                favorites, self.user.id, self.recipe.id, ('id', 'name'))
+        self.assertTrue(created)
+        self.assertEqual(member.name, self.recipe.name)
+        statements = get_statements(queries)
+        self.assertEqual(len(statements), 1)
+        self.assertIn('ON CONFLICT DO NOTHING', statements[0])
+
+
+class RecipeCreateTest(ApiTestCase):
+    """Создание рецепта одной транзакцией с короткой ссылкой."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Автор, тег и ингредиент."""
+        cls.author = create_user('author')
+        cls.tag = Tag.objects.create(name='Ужин', slug='dinner')
+        cls.ingredient = Ingredient.objects.create(
+            name='Рис', measurement_unit='г')
+
+    def setUp(self):
+        """Авторизация и картинки во временном каталоге."""
+        super().setUp()
+        self.client.force_authenticate(self.author)
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        media = override_settings(MEDIA_ROOT=directory.name)
+        media.enable()
+        self.addCleanup(media.disable)
+
+    def post_recipe(self, name):
+        """Рецепт, созданный через API, и выполненные запросы."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(RECIPES_URL, {
+                'name': name, 'text': 'Текст', 'cooking_time': 20,
+                'image': PIXEL_PNG, 'tags': [self.tag.id],
+                'ingredients': [{'id': self.ingredient.id, 'amount': 100}],
+            }, format='json')
+        self.assertEqual(response.status_code, 201)
+        return Recipe.objects.get(pk=response.json()['id']), queries
+
+    def test_short_url(self):
+        """Короткая ссылка вычислена по id нового рецепта."""
+        for name in ('Плов', 'Ризотто'):
+            recipe, _ = self.post_recipe(name)
+            self.assertEqual(
+                recipe.short_url,
+                RecipeWriteSerializer().convert_to_short_link(recipe.pk))
+            self.assertEqual(
+                list(recipe.recipe_ingredients.values_list(
+                    'ingredient_id', 'amount')),
+                [(self.ingredient.id, 100)])
+
+    @postgres_only
+    def test_allocate_ids(self):
+        """Id из последовательности не повторяются и не заняты."""
+        ids = Recipe.objects.allocate_ids(3)
+        self.assertEqual(len(set(ids)), 3)
+        recipe, _ = self.post_recipe('Плов')
+        self.assertGreater(recipe.pk, max(ids))
+
+    @postgres_only
+    def test_single_insert(self):
+        """На Postgres рецепт вставляется одним INSERT без UPDATE."""
+        _, queries = self.post_recipe('Плов')
+        table = connection.ops.quote_name(Recipe._meta.db_table)
+        statements = [statement for statement in get_statements(queries)
+                      if table in statement.split(' WHERE ')[0]]
+        self.assertEqual(
+            [statement.split()[0] for statement in statements
+             if statement.startswith(('INSERT', 'UPDATE'))],
+            ['INSERT'])
+
+    @skipUnless(not is_postgres, 'Проверка запасного варианта.')
+    def test_allocate_ids_fallback(self):
+        """Без последовательностей id не выделяются заранее."""
+        self.assertIsNone(Recipe.objects.allocate_ids(3))
+
+
+@mock.patch.object(feed, 'FANOUT_LIMIT', 1)
+class FeedTest(ApiTestCase):
+    """Лента при переходе автора через FANOUT_LIMIT и обратно."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Читатель, второй подписчик и автор с двумя рецептами."""
+        cls.reader, cls.other, cls.author = (
+            create_user(name) for name in ('reader', 'other', 'author'))
+        cls.recipes = [
+            create_recipe(cls.author, number)
+            for number in range(2)
+        ]
+
+    def setUp(self):
+        """Соединение с Redis."""
+        super().setUp()
+        self.redis = feed.get_redis()
+
+    def subscribe(self, user, method='post'):
+        """Подписка или отписка с выполнением действий после фиксации."""
+        self.client.force_authenticate(user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(
+                f'{USERS_URL}{self.author.id}/subscribe/')
+        self.assertIn(response.status_code, (200, 204))
+
+    def assert_feed(self, recipes):
+        """Лента читателя: число и рецепты совпадают."""
+        self.client.force_authenticate(self.reader)
+        response = self.client.get(FEED_URL)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], len(recipes))
+        self.assertEqual([recipe['id'] for recipe in data['results']],
+                         [recipe.id for recipe in reversed(recipes)])
+
+    def test_pulled_author(self):
+        """Рецепты помеченного автора не считаются дважды."""
+        self.subscribe(self.reader)
+        self.assert_feed(self.recipes)
+        self.subscribe(self.other)
+        self.assertEqual(feed.get_pulled_authors(self.redis),
+                         {self.author.id})
+        self.assertGreater(self.redis.ttl(feed.PULLED_AUTHORS_KEY), 0)
+        self.assert_feed(self.recipes)
+        recipe = create_recipe(self.author, 2)
+        feed.push_recipes((recipe,))
+        self.assert_feed([*self.recipes, recipe])
+        self.subscribe(self.other, 'delete')
+        self.assertEqual(feed.get_pulled_authors(self.redis), set())
+        self.assert_feed([*self.recipes, recipe])
+
+    def test_reload_pulled_authors(self):
+        """Потерянное множество помеченных авторов собирается из базы."""
+        self.subscribe(self.reader)
+        self.subscribe(self.other)
+        self.redis.delete(feed.PULLED_AUTHORS_KEY)
+        self.assertTrue(feed.is_pulled(self.redis, self.author.id))
+        self.assert_feed(self.recipes)
+
+
+class MembershipLoadTest(ApiTestCase):
+    """Загрузка множества не затирает запись, пришедшую во время чтения."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Пользователь и рецепт."""
+        cls.user = create_user('reader')
+        cls.recipe = create_recipe(cls.user)
+
+    def test_write_during_load(self):
+        """SADD между чтением базы и записью множества не теряется."""
+        read = favorites.read
+        calls = []
+
+        def stale_read(user_id):
+            object_ids = read(user_id)
+            if not calls:
+                favorites.model.objects.create(
+                    user=self.user, recipe=self.recipe)
+                favorites.redis.sadd(
+                    favorites.get_key(self.user.id), self.recipe.id)
+            calls.append(object_ids)
+            return object_ids
+
+        with mock.patch.object(favorites, 'read', side_effect=stale_read):
+            self.assertEqual(favorites.load(self.user.id), {self.recipe.id})
+        self.assertEqual(calls, [set(), {self.recipe.id}])
+        self.assertEqual(favorites.members(self.user.id), {self.recipe.id})
+
+
+class RecipeSearchPaginationTest(ApiTestCase):
+    """Поиск с pagination=cursor сохраняет порядок по релевантности."""
+
+    @classmethod
+    def setUpTestData(cls):
+        """Рецепты с разной релевантностью и датой публикации."""
+        cls.author = create_user('author')
+        for number, (name, text) in enumerate((
+                ('Грибной суп', 'Суп из грибов'),
+                ('Салат', 'Салат с грибами'),
+                ('Пирог', 'Без начинки'))):
+            create_recipe(cls.author, number, name=name, text=text)
+
+    def test_cursor_search_uses_pages(self):
+        """Ответ постраничный и в том же порядке, что без курсора."""
+        ranked = self.client.get(RECIPES_URL, {'search': 'грибной суп'})
+        response = self.client.get(
+            RECIPES_URL, {'search': 'грибной суп', 'pagination': 'cursor'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('count', response.json())
+        self.assertEqual(response.json()['results'],
+                         ranked.json()['results'])
+        self.assertEqual(response.json()['results'][0]['name'],
+                         'Грибной суп')
+        response = self.client.get(RECIPES_URL, {'pagination': 'cursor'})
+        self.assertNotIn('count', response.json())
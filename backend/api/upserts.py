@@ -0,0 +1,88 @@
+"""Добавление в избранное, список покупок и подписки одним запросом."""
+
+from django.db import IntegrityError, connection, transaction  # type: ignore
+
+from .bulk import after_change
+
+
+def get_insert_sql(membership_set, columns):
+    """
+    Запрос: строка объекта и признак, что связь вставлена.
+
+    Нет строки — объекта нет; False — связь уже была.
+    """
+    quote = connection.ops.quote_name
+    meta = membership_set.model._meta
+    target_meta = membership_set.object_model._meta
+    selected = ', '.join(quote(column) for column in columns)
+    target_pk = quote(target_meta.pk.column)
+    return (
+        f'WITH target AS ('
+        f'SELECT {selected} FROM {quote(target_meta.db_table)} '
+        f'WHERE {target_pk} = %s), '
+        f'inserted AS ('
+        f'INSERT INTO {quote(meta.db_table)} '
+        f'({quote(meta.get_field("user").column)}, '
+        f'{quote(meta.get_field(membership_set.object_field).column)}) '
+        f'SELECT %s, {target_pk} FROM target '
+        f'ON CONFLICT DO NOTHING RETURNING 1) '
+        f'SELECT {selected}, EXISTS (SELECT 1 FROM inserted) FROM target'
+    )
+
+
+def insert_returning(membership_set, user_id, object_id, columns):
+    """Вставка связи на Postgres: INSERT ... ON CONFLICT DO NOTHING."""
+    with connection.cursor() as cursor:
+        cursor.execute(get_insert_sql(membership_set, columns),
+                       (object_id, user_id))
+        row = cursor.fetchone()
+    if row is None:
+        return None, False
+    return row[:-1], row[-1]
+
+
+def insert_with_savepoint(membership_set, user_id, object_id, fields):
+    """Вставка связи на других базах: чтение объекта и вставка."""
+    values = membership_set.object_model.objects.filter(
+        pk=object_id).values_list(*fields).first()
+    if values is None:
+        return None, False
+    model = membership_set.model
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create((model(**{
+                'user_id': user_id,
+                membership_set.object_field: object_id,
+            }),))
+    except IntegrityError:
+        return values, False
+    return values, True
+
+
+def add_member(membership_set, user_id, object_id, fields):
+    """
+    Идемпотентное добавление объекта в список пользователя.
+
+    Возвращает (объект, добавлен ли); объект — None, если его нет.
+    У объекта загружены только поля fields, остальные отложены. На
+    Postgres существование объекта, вставка и чтение полей для ответа —
+    один запрос. Сигналы не отправляются, производные данные обновляет
+    after_change.
+    """
+    target_model = membership_set.object_model
+    fields = [field.attname for field in target_model._meta.concrete_fields
+              if field.attname in fields]
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            values, created = insert_returning(
+                membership_set, user_id, object_id,
+                [target_model._meta.get_field(field).column
+                 for field in fields])
+        else:
+            values, created = insert_with_savepoint(
+                membership_set, user_id, object_id, fields)
+        if created:
+            after_change(membership_set, user_id, (object_id,), 1)
+    if values is None:
+        return None, False
+    return target_model.from_db(connection.alias, fields, values), created
@@ -4,12 +4,15 @@ from django.urls import include, path  # type: ignore
 from rest_framework import routers  # type: ignore
 
 from .views import (TagViewSet, RecipeViewSet, IngredientViewSet, UserViewSet,
-                    ShortLinkView, LoadDataView)
+                    ShortLinkView, LoadDataView, ShoppingListExportViewSet)
 
 app_name: str = 'api'
 
 router_v1 = routers.DefaultRouter()
 router_v1.register('tags', TagViewSet, basename='tags')
+router_v1.register('recipes/download_shopping_cart/jobs',
+                   ShoppingListExportViewSet,
+                   basename='shopping_list_exports')
 router_v1.register('recipes', RecipeViewSet, basename='recipes')
 router_v1.register('ingredients', IngredientViewSet, basename='ingredients')
 router_v1.register('users', UserViewSet, basename='users')
@@ -1,38 +1,49 @@
 """Контроллеры."""
 
 import json
+from functools import partial
 
 from rest_framework.permissions import (AllowAny,  # type: ignore
                                         IsAuthenticated)
-from rest_framework import filters, viewsets, status  # type: ignore
+from rest_framework import filters, mixins, viewsets, status  # type: ignore
 from django.contrib.auth import get_user_model  # type: ignore
 from rest_framework.decorators import action  # type: ignore
 from rest_framework.response import Response  # type: ignore
 from django.shortcuts import get_object_or_404  # type: ignore
 from django.conf import settings  # type: ignore
 from rest_framework.views import APIView  # type: ignore
-from django.http import HttpResponse  # type: ignore
+from django.http import (FileResponse, Http404,  # type: ignore
+                         StreamingHttpResponse)
+from django.db.models import Count  # type: ignore
 from django_filters.rest_framework import DjangoFilterBackend  # type: ignore
-from django.db.models import Sum, F  # type: ignore
 from django.shortcuts import redirect  # type: ignore
 
-from recipes.models import Tag, Recipe, Ingredient, RecipeIngredient
-from users.models import Favorite, Subscription, ShoppingCart
+from recipes.models import Tag, Recipe, Ingredient
+from users import membership
+from users.models import ExportStatus, Favorite, Subscription
+from . import bulk, feed
 from .serializers import (TagSerializer, RecipeWriteSerializer,
                           RecipeReadSerializer, IngredientSerializer,
                           UserReadSerializer, UserWriteSerializer,
                           PasswordSerializer, FavoriteCreateSerializer,
                           SubscriptionSerializer, ShoppingCreateSerializer,
-                          AvatarSerializer, SubscriptionCreateSerializer)
+                          AvatarSerializer, SubscriptionCreateSerializer,
+                          BulkRecipesSerializer,
+                          ShoppingListExportSerializer)
 from .permissions import AuthorOnly, ForbiddenPermission
 from .filters import RecipeFilter
-from .drf_cache import CacheResponseMixin
-from .pagination import LimitPagination
+from .exports import create_export
+from .drf_cache import (CacheResponseMixin, ConditionalGetMixin,
+                        SharedPageMixin)
+from .ingredient_index import ingredient_index, ingredient_search
+from .pagination import FeedPagination, LimitPagination, RecipePagination
+from .shopping_list import SHOPPING_LIST_RENDERERS, get_shopping_list
 
 User = get_user_model()
 
 
-class BaseReadOnlyViewset(CacheResponseMixin, viewsets.ReadOnlyModelViewSet):
+class BaseReadOnlyViewset(ConditionalGetMixin, CacheResponseMixin,
+                          viewsets.ReadOnlyModelViewSet):
     """Базовый вьюсет для чтения."""
 
     permission_classes = (AllowAny,)
@@ -49,39 +60,59 @@ class TagViewSet(BaseReadOnlyViewset):
 class IngredientViewSet(BaseReadOnlyViewset):
     """Вьюсет ингредиентов."""
 
+    queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
 
-    def get_queryset(self):
-        """Поиск по вхождению в начало строки."""
-        query = self.request.query_params.get('name')
-        if query:
-            return Ingredient.objects.filter(name__istartswith=query)
-        return Ingredient.objects.all()
+    def list(self, request, *args, **kwargs):
+        """Поиск ингредиентов с ETag и кэшем ответа."""
+        return self.get_conditional_response(
+            partial(self.get_cached_response, self.search_ingredients),
+            request, *args, **kwargs)
+
+    def search_ingredients(self, request, *args, **kwargs):
+        """
+        Поиск ингредиентов.
 
+        По параметру name — по вхождению в начало строки, по параметру
+        search — ранжированный поиск с учетом опечаток.
+        """
+        query = request.query_params.get('search')
+        if query is not None:
+            return Response(ingredient_search.search(query))
+        return Response(ingredient_index.prefix_search(
+            request.query_params.get('name', '')))
 
-class RecipeViewSet(viewsets.ModelViewSet):
+
+class RecipeViewSet(ConditionalGetMixin, SharedPageMixin,
+                    viewsets.ModelViewSet):
     """Вьюсет рецептов."""
 
     http_method_names = ('get', 'post', 'patch', 'delete')
     filter_backends = (DjangoFilterBackend, filters.OrderingFilter)
     filterset_class = RecipeFilter
-    pagination_class = LimitPagination
+    pagination_class = RecipePagination
+    etag_models = SharedPageMixin.shared_page_models
+    etag_per_user = True
 
     def get_queryset(self):
         """Кверисет."""
-        user = self.request.user
-        return Recipe.objects.annotate_fields(user)
+        return Recipe.objects.annotate_fields(self.get_page_user())
 
     def get_permissions(self):
         """Разрешения."""
         if self.action in {'list', 'retrieve', 'get_link'}:
             self.permission_classes = (AllowAny,)
         elif self.action in {'create',
+                             'feed',
                              'download_shopping_cart',
                              'favorite',
                              'delete_favorite',
                              'shopping_cart',
-                             'delete_shopping_cart'}:
+                             'delete_shopping_cart',
+                             'bulk_favorite',
+                             'bulk_delete_favorite',
+                             'bulk_shopping_cart',
+                             'bulk_delete_shopping_cart'}:
             self.permission_classes = (IsAuthenticated,)
         elif self.action in {'partial_update', 'destroy'}:
             self.permission_classes = (AuthorOnly,)
@@ -91,12 +122,14 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
     def get_serializer_class(self):
         """Выбор сериализатора."""
-        if self.action in {'list', 'retrieve'}:
+        if self.action in {'list', 'retrieve', 'feed'}:
             return RecipeReadSerializer
         if self.action == 'favorite':
             return FavoriteCreateSerializer
         if self.action == 'shopping_cart':
             return ShoppingCreateSerializer
+        if self.action.startswith('bulk_'):
+            return BulkRecipesSerializer
         return RecipeWriteSerializer
 
     @action(
@@ -106,11 +139,7 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     def favorite(self, request, pk):
         """Добавление в избранное."""
-        self.lookup_field = 'pk'
-        recipe = self.get_object()
-        serializer = self.get_serializer(recipe,
-                                         data={'id': pk},
-                                         context={'request': request})
+        serializer = self.get_serializer(data={'id': pk})
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return Response(serializer.data)
@@ -123,39 +152,80 @@ class RecipeViewSet(viewsets.ModelViewSet):
         favorite.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
-    def convert_to_txt(self, recipes):
-        """Конвертация в TXT."""
-        if not recipes:
-            return 'Нет рецептов в списке покупок.'
-        recipe_ingredients = (RecipeIngredient.objects.
-                              filter(recipe__in=recipes))
-        ingredients = recipe_ingredients.values(
-            name=F('ingredient__name'),
-            measurement_unit=F('ingredient__measurement_unit')).annotate(
-            total_amount=Sum('amount')).order_by('name')
-        if not ingredients.exists():
-            return 'Нет ингредиентов для покупки.'
-        txt = ['Список покупок.\n\n']
-        txt.extend('\n'.join(
-            ((f'{ingredient.get("name")}:  '
-              f'{ingredient.get("measurement_unit")} '
-              f'— {ingredient.get("total_amount")}')
-             for ingredient in ingredients)
-        ))
-        return txt
+    def bulk_change(self, change, membership_set):
+        """Пакетное изменение списка пользователя."""
+        serializer = self.get_serializer(data=self.request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(change(membership_set, self.request.user.id,
+                               serializer.validated_data['recipes']))
 
     @action(
         detail=False,
-        permission_classes=(IsAuthenticated,)
+        methods=('post',),
+        url_path='favorite/bulk',
+        url_name='favorite_bulk',
+    )
+    def bulk_favorite(self, request):
+        """Добавление рецептов в избранное: {"recipes": [id, ...]}."""
+        return self.bulk_change(bulk.add_recipes, membership.favorites)
+
+    @bulk_favorite.mapping.delete
+    def bulk_delete_favorite(self, request):
+        """Удаление рецептов из избранного."""
+        return self.bulk_change(bulk.remove_recipes, membership.favorites)
+
+    @action(
+        detail=False,
+        methods=('post',),
+        url_path='shopping_cart/bulk',
+        url_name='shopping_cart_bulk',
+    )
+    def bulk_shopping_cart(self, request):
+        """Добавление рецептов в список покупок."""
+        return self.bulk_change(bulk.add_recipes, membership.shopping_cart)
+
+    @bulk_shopping_cart.mapping.delete
+    def bulk_delete_shopping_cart(self, request):
+        """Удаление рецептов из списка покупок."""
+        return self.bulk_change(bulk.remove_recipes, membership.shopping_cart)
+
+    @action(
+        detail=False,
+        permission_classes=(IsAuthenticated,),
+        pagination_class=FeedPagination,
+    )
+    def feed(self, request):
+        """
+        Лента рецептов авторов, на которых подписан пользователь.
+
+        Новые рецепты сверху, параметры limit и page.
+        """
+        page = self.paginate_queryset(
+            feed.Timeline(request.user.id, self.get_queryset()))
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False,
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=SHOPPING_LIST_RENDERERS,
     )
     def download_shopping_cart(self, request):
-        """Получение списка покупок в формате PDF."""
-        user = request.user
-        recipes = user.shopping_cart.all()
-        txt = self.convert_to_txt(recipes)
-        response = HttpResponse(txt, content_type='text/plain; charset=UTF-8')
-        response['Content-Disposition'] = ('attachment; '
-                                           'filename="shopping-list.txt"')
+        """
+        Получение списка покупок.
+
+        Формат выбирается параметром format: txt (по умолчанию), csv,
+        json или pdf. Документ отдается потоком по мере чтения строк.
+        """
+        renderer = request.accepted_renderer
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        response = StreamingHttpResponse(
+            renderer.stream(get_shopping_list(request.user)),
+            content_type=content_type)
+        response['Content-Disposition'] = (
+            f'attachment; filename="shopping-list.{renderer.format}"')
         return response
 
     @action(
@@ -165,23 +235,27 @@ class RecipeViewSet(viewsets.ModelViewSet):
     )
     def shopping_cart(self, request, pk):
         """Добавление рецепта в список покупок."""
-        self.lookup_field = 'pk'
-        recipe = self.get_object()
-        serializer = self.get_serializer(recipe,
-                                         data={'id': pk},
-                                         context={'request': request})
+        serializer = self.get_serializer(data={'id': pk})
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return Response(serializer.data)
 
     @shopping_cart.mapping.delete
     def delete_shopping_cart(self, request, pk):
-        """Удаление из списка покупок."""
-        user = request.user
-        shopping = get_object_or_404(ShoppingCart,
-                                     user=user,
-                                     recipe__id=pk)
-        shopping.delete()
+        """
+        Удаление из списка покупок.
+
+        Через пакетное удаление: сводный список меняется, только если
+        строку удалил этот запрос, а не параллельный.
+        """
+        try:
+            recipe_id = int(pk)
+        except ValueError:
+            raise Http404
+        result, = bulk.remove_recipes(
+            membership.shopping_cart, request.user.id, (recipe_id,))
+        if result['status'] != bulk.REMOVED:
+            raise Http404
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -207,6 +281,8 @@ class UserViewSet(viewsets.ModelViewSet):
     http_method_names = ('get', 'post', 'put', 'delete')
     permission_classes = (AllowAny,)
     filter_backends = (DjangoFilterBackend, filters.OrderingFilter)
+    pagination_class = LimitPagination
+    count_per_user_actions = ('subscriptions',)
 
     def get_queryset(self):
         """Получение списка пользователей."""
@@ -263,7 +339,7 @@ class UserViewSet(viewsets.ModelViewSet):
         serializer.is_valid(raise_exception=True)
         password = serializer.validated_data['new_password']
         user.set_password(password)
-        user.save()
+        user.save(update_fields=('password',))
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     def get_serializer_class(self):
@@ -289,10 +365,7 @@ class UserViewSet(viewsets.ModelViewSet):
     )
     def subscribe(self, request, pk):
         """Подписка."""
-        user = request.user
-        serializer = self.get_serializer(user,
-                                         data={'id': pk},
-                                         context={'request': request})
+        serializer = self.get_serializer(data={'id': pk})
         serializer.is_valid(raise_exception=True)
         serializer.save()
         return Response(serializer.data)
@@ -319,7 +392,9 @@ class UserViewSet(viewsets.ModelViewSet):
     def subscriptions(self, request):
         """Список подписок."""
         user = request.user
-        queryset = user.subscriptions.all()
+        queryset = user.subscriptions.annotate(
+            recipes_count=Count('recipes'),
+        ).order_by(*User._meta.ordering)
         query = self.request.query_params.get('limit')
         if query:
             queryset = queryset[:int(query)]
@@ -330,6 +405,52 @@ class UserViewSet(viewsets.ModelViewSet):
         return self.get_paginated_response(serializer.data)
 
 
+class ShoppingListExportViewSet(mixins.CreateModelMixin,
+                                mixins.RetrieveModelMixin,
+                                viewsets.GenericViewSet):
+    """
+    Фоновая выгрузка списка покупок.
+
+    POST ставит задание в очередь и возвращает его id, GET отдает
+    состояние задания, пока файл не готов, а затем сам файл. Ошибка
+    задания — не ошибка запроса: ответ 200 со status failed и error.
+    """
+
+    serializer_class = ShoppingListExportSerializer
+    permission_classes = (IsAuthenticated,)
+    lookup_value_regex = '[0-9a-f-]{36}'
+
+    def get_queryset(self):
+        """Задания текущего пользователя."""
+        return self.request.user.shopping_list_exports.all()
+
+    def create(self, request):
+        """Постановка выгрузки в очередь."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        job = create_export(request.user,
+                            serializer.validated_data['format'])
+        return Response(self.get_serializer(job).data,
+                        status=status.HTTP_202_ACCEPTED)
+
+    def retrieve(self, request, pk):
+        """Состояние задания или готовый файл."""
+        job = self.get_object()
+        if job.status == ExportStatus.DONE:
+            if job.file.storage.exists(job.file.name):
+                return FileResponse(
+                    job.file.open('rb'), as_attachment=True,
+                    filename=f'shopping-list.{job.format}')
+            job.status = ExportStatus.PENDING
+            job.save(update_fields=('status', 'updated'))
+        if job.status == ExportStatus.FAILED:
+            response_status = status.HTTP_200_OK
+        else:
+            response_status = status.HTTP_202_ACCEPTED
+        return Response(self.get_serializer(job).data,
+                        status=response_status)
+
+
 class ShortLinkView(APIView):
     """Класс коротких ссылок."""
 
@@ -25,6 +25,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
@@ -88,6 +89,8 @@ CACHES = {
     }
 }
 
+REDIS_TEST_DB: int = int(os.getenv('REDIS_TEST_DB', 15))  # Redis DB flushed by tests
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -126,9 +129,17 @@ STATIC_ROOT = BASE_DIR / 'collected_static'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+SHOPPING_LIST_EXPORT_ROOT = os.getenv('SHOPPING_LIST_EXPORT_ROOT', BASE_DIR / 'exports')
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
-CACHE_TIMEOUT: int = 5  # Cache timeout in seconds
+CACHE_TIMEOUT: int = int(os.getenv('CACHE_TIMEOUT', 6 * 60 * 60))  # Cache timeout in seconds
+
+PAGINATION_ESTIMATED_COUNT = os.getenv('PAGINATION_ESTIMATED_COUNT', 'False').lower() != 'false'
+
+SHARED_RECIPE_PAGES = os.getenv('SHARED_RECIPE_PAGES', 'True').lower() != 'false'
+
+SHOPPING_LIST_PDF_FONT = os.getenv('SHOPPING_LIST_PDF_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
 
 REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
@@ -136,7 +147,7 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
     ],
 
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
@@ -4,6 +4,7 @@ from rest_framework.authtoken.admin import TokenAdmin  # type: ignore
 from rest_framework.authtoken.models import Token  # type: ignore
 
 from .models import Ingredient, Tag, Recipe, RecipeIngredient
+from users import shopping_list
 from users.models import ShoppingCart, Favorite
 
 
@@ -50,6 +51,11 @@ class RecipeAdmin(BaseAdmin):
         """Число добавлений в избранное."""
         return recipe.favorites.count()
 
+    def save_related(self, request, form, formsets, change):
+        """Пересчет поискового документа после сохранения тегов."""
+        super().save_related(request, form, formsets, change)
+        Recipe.objects.filter(pk=form.instance.pk).update_search_documents()
+
 
 class IngredientAdmin(BaseAdmin):
     """Регистрация ингредиентов."""
@@ -80,6 +86,31 @@ class RecipeIngredientAdmin(BaseAdmin):
     verbose_name = 'Ингредиент в рецепте'
     verbose_name_plural = 'Ингредиенты в рецепте'
 
+    def refresh_recipes(self, recipe_ids):
+        """Пересчет поисковых документов и сводных списков покупок."""
+        Recipe.objects.filter(pk__in=recipe_ids).update_search_documents()
+        shopping_list.rebuild(ShoppingCart.objects.filter(
+            recipe_id__in=recipe_ids).values_list('user_id', flat=True))
+
+    def save_model(self, request, obj, form, change):
+        """Пересчет данных, зависящих от ингредиентов рецепта."""
+        super().save_model(request, obj, form, change)
+        recipe_ids = {obj.recipe_id}
+        if change:
+            recipe_ids.add(form.initial['recipe'])
+        self.refresh_recipes(recipe_ids)
+
+    def delete_model(self, request, obj):
+        """Пересчет данных, зависящих от ингредиентов рецепта."""
+        super().delete_model(request, obj)
+        self.refresh_recipes((obj.recipe_id,))
+
+    def delete_queryset(self, request, queryset):
+        """Пересчет данных, зависящих от ингредиентов рецептов."""
+        recipe_ids = set(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        self.refresh_recipes(recipe_ids)
+
 
 class FavoriteAdmin(BaseAdmin):
     """Регистрация избранного."""
@@ -9,3 +9,4 @@ MAX_INGREDIENT_AMOUNT: int = 100_000
 MIN_INGREDIENT_AMOUNT: int = 1
 MAX_COOKING_TIME: int = 100_000
 MIN_COOKING_TIME: int = 1
+SEARCH_CONFIG: str = 'russian'
@@ -0,0 +1,38 @@
+"""Поля моделей."""
+
+import json
+
+from django.contrib.postgres.fields import ArrayField  # type: ignore
+
+
+class IdArrayField(ArrayField):
+    """
+    Массив id.
+
+    В Postgres — integer[] с операторами массивов и GIN-индексом, в
+    остальных СУБД (тесты на SQLite) — JSON-список в текстовой колонке.
+    """
+
+    def db_type(self, connection):
+        """Тип колонки."""
+        if connection.vendor == 'postgresql':
+            return super().db_type(connection)
+        return 'text'
+
+    def get_placeholder(self, value, compiler, connection):
+        """Плейсхолдер значения: приведение типа нужно только в Postgres."""
+        if connection.vendor == 'postgresql':
+            return super().get_placeholder(value, compiler, connection)
+        return '%s'
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        """Значение для записи в базу."""
+        if connection.vendor == 'postgresql' or value is None:
+            return super().get_db_prep_value(value, connection, prepared)
+        return json.dumps(sorted(value))
+
+    def from_db_value(self, value, expression, connection):
+        """Список id из значения колонки."""
+        if isinstance(value, str):
+            return json.loads(value)
+        return value
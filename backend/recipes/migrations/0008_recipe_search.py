@@ -0,0 +1,55 @@
+import django.contrib.postgres.search
+from django.contrib.postgres.search import SearchVector
+from django.db import migrations, models
+
+SEARCH_CONFIG = 'russian'
+
+
+def fill_search_documents(apps, schema_editor):
+    """Поисковые документы существующих рецептов и GIN-индекс (Postgres)."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    recipes = list(Recipe.objects.only('pk').prefetch_related(
+        'tags', 'ingredients'))
+    for recipe in recipes:
+        recipe.search_document = ' '.join((
+            *(tag.name for tag in recipe.tags.all()),
+            *(ingredient.name for ingredient in recipe.ingredients.all()),
+        ))
+    Recipe.objects.bulk_update(recipes, ('search_document',), batch_size=500)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Recipe.objects.update(search_vector=(
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('search_document', weight='B', config=SEARCH_CONFIG)
+        + SearchVector('text', weight='C', config=SEARCH_CONFIG)))
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipes_recipe_search_vector '
+        'ON recipes_recipe USING gin (search_vector)')
+
+
+def drop_search_index(apps, schema_editor):
+    """Удаление GIN-индекса поискового вектора."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS recipes_recipe_search_vector')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_ingredient_name_trgm'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_document',
+            field=models.TextField(blank=True, editable=False, verbose_name='Теги и ингредиенты для поиска'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(fill_search_documents, drop_search_index),
+    ]
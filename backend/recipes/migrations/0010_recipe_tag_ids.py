@@ -0,0 +1,53 @@
+import django.db.models
+from django.db import migrations
+
+import recipes.fields
+
+
+def fill_tag_ids(apps, schema_editor):
+    """Id тегов существующих рецептов и GIN-индекс (Postgres)."""
+    Recipe = apps.get_model('recipes', 'Recipe')
+    tag_ids = {}
+    for recipe_id, tag_id in Recipe.tags.through.objects.order_by(
+            'tag_id').values_list('recipe_id', 'tag_id'):
+        tag_ids.setdefault(recipe_id, []).append(tag_id)
+    Recipe.objects.bulk_update(
+        [Recipe(pk=recipe_id, tag_ids=ids)
+         for recipe_id, ids in tag_ids.items()],
+        ('tag_ids',), batch_size=500)
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS recipes_recipe_tag_ids '
+        'ON recipes_recipe USING gin (tag_ids)')
+
+
+def drop_tag_ids_index(apps, schema_editor):
+    """Удаление GIN-индекса id тегов."""
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS recipes_recipe_tag_ids')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_tag_mask'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='tag_ids',
+            field=recipes.fields.IdArrayField(base_field=django.db.models.IntegerField(), blank=True, default=list, editable=False, size=None, verbose_name='Id тегов'),
+        ),
+        migrations.RunPython(fill_tag_ids, drop_tag_ids_index),
+        migrations.RemoveField(
+            model_name='recipe',
+            name='tag_mask',
+        ),
+        migrations.RemoveField(
+            model_name='tag',
+            name='bit',
+        ),
+    ]
@@ -3,6 +3,7 @@
 import re
 
 from django.db import models  # type: ignore
+from django.contrib.postgres.search import SearchVectorField  # type: ignore
 from django.contrib.auth import get_user_model  # type: ignore
 from django.core.validators import (MaxValueValidator,  # type: ignore
                                     MaxLengthValidator,
@@ -13,6 +14,7 @@ from .constants import (MAX_NAME_LENGTH, MAX_SLUG_LENGTH, MAX_UNIT_LENGTH,
                         MAX_INGREDIENT_AMOUNT, MIN_INGREDIENT_AMOUNT,
                         MAX_COOKING_TIME, MIN_COOKING_TIME,
                         MAX_TAG_NAME_LENGTH, MAX_INGREDIENT_NAME_LENGTH)
+from .fields import IdArrayField
 from .querysets import AnnotatedRecipeQuerySet
 
 
@@ -116,6 +118,14 @@ class Recipe(models.Model):
                                     db_index=True)
     short_url = models.TextField(verbose_name='Короткая ссылка',
                                  blank=True, unique=True)
+    search_document = models.TextField(
+        verbose_name='Теги и ингредиенты для поиска',
+        blank=True, editable=False)
+    search_vector = SearchVectorField(verbose_name='Поисковый вектор',
+                                      null=True, editable=False)
+    tag_ids = IdArrayField(models.IntegerField(),
+                           verbose_name='Id тегов',
+                           default=list, blank=True, editable=False)
     objects = AnnotatedRecipeQuerySet.as_manager()
 
     class Meta:
@@ -129,6 +139,11 @@ class Recipe(models.Model):
         """Строковое представление."""
         return self.name
 
+    def update_tag_ids(self):
+        """Пересчет id тегов рецепта по таблице связи."""
+        self.tag_ids = sorted(self.tags.values_list('pk', flat=True))
+        Recipe.objects.filter(pk=self.pk).update(tag_ids=self.tag_ids)
+
 
 class RecipeIngredient(models.Model):
     """Промежуточная таблица с указанием количества ингредиентов."""
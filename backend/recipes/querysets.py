@@ -1,33 +1,166 @@
 """Аннотирование полей модели."""
 
+from django.contrib.postgres.search import SearchVector  # type: ignore
+from django.db import connections  # type: ignore
 from django.db.models.query import QuerySet  # type: ignore
-from django.db.models import Value  # type: ignore
-from django.db.models import Exists, OuterRef  # type: ignore
+from django.db.models import BooleanField, Case, F, Value, When  # type: ignore
+from django.db.models import Prefetch, Window  # type: ignore
+from django.db.models.expressions import RawSQL  # type: ignore
+from django.db.models.functions import RowNumber  # type: ignore
 
-from users.models import Favorite, ShoppingCart
+from users.membership import favorites, shopping_cart
+from .constants import SEARCH_CONFIG
+
+
+def in_ids(ids):
+    """Выражение: входит ли pk в множество id."""
+    if not ids:
+        return Value(False)
+    return Case(When(pk__in=ids, then=Value(True)),
+                default=Value(False),
+                output_field=BooleanField())
+
+
+def get_search_document(tag_names, ingredient_names):
+    """Поисковый документ: названия тегов и ингредиентов рецепта."""
+    return ' '.join((*tag_names, *ingredient_names))
+
+
+def get_search_vector(name='name', document='search_document', text='text'):
+    """
+    Вектор рецепта: название (A), теги и ингредиенты (B), текст (C).
+
+    Вместо полей можно передать выражения, например значения из памяти,
+    чтобы записать вектор тем же UPDATE, что и остальные поля.
+    """
+    return (SearchVector(name, weight='A', config=SEARCH_CONFIG)
+            + SearchVector(document, weight='B', config=SEARCH_CONFIG)
+            + SearchVector(text, weight='C', config=SEARCH_CONFIG))
 
 
 class AnnotatedRecipeQuerySet(QuerySet):
     """Аннотированный queryset."""
 
-    def annotate_fields(self, user):
-        """Аннотировать queryset."""
+    def with_related(self):
+        """
+        План запроса для чтения рецептов.
+
+        Автор подгружается через JOIN, теги и количества ингредиентов —
+        по одному запросу на страницу. Не зависит от пользователя.
+        """
+        from .models import RecipeIngredient
+        return self.select_related('author').prefetch_related(
+            'tags',
+            Prefetch(
+                'recipe_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient').order_by('ingredient__name'),
+            ),
+        )
+
+    def annotate_user_flags(self, user):
+        """
+        Аннотировать флаги избранного и списка покупок пользователя.
+
+        Id рецептов берутся из множеств пользователя в Redis.
+        """
         if not user.is_authenticated:
             return self.annotate(
                 is_favorited=Value(False),
                 is_in_shopping_cart=Value(False),
             )
-        return (
-            self.select_related('author')
-            .prefetch_related('tags', 'ingredients')
-            .annotate(
-                is_favorited=Exists(
-                    Favorite.objects.filter(recipe=OuterRef('pk'), user=user)
-                ),
-                is_in_shopping_cart=Exists(
-                    ShoppingCart.objects.filter(
-                        recipe=OuterRef('pk'), user=user
-                    )
-                ),
-            )
+        return self.annotate(
+            is_favorited=in_ids(favorites.members(user.id)),
+            is_in_shopping_cart=in_ids(shopping_cart.members(user.id)),
         )
+
+    def annotate_fields(self, user):
+        """Аннотировать queryset."""
+        return self.with_related().annotate_user_flags(user)
+
+    def update_search_documents(self):
+        """
+        Пересчет поисковых документов рецептов выборки.
+
+        Документ — названия тегов и ингредиентов рецепта. На Postgres
+        вместе с ним обновляется взвешенный вектор для GIN-индекса.
+        """
+        recipes = list(self.order_by().only('pk').prefetch_related(
+            'tags', 'ingredients'))
+        if not recipes:
+            return 0
+        for recipe in recipes:
+            recipe.search_document = get_search_document(
+                (tag.name for tag in recipe.tags.all()),
+                (ingredient.name for ingredient in recipe.ingredients.all()),
+            )
+        self.model.objects.bulk_update(recipes, ('search_document',))
+        if connections[self.db].vendor == 'postgresql':
+            self.model.objects.filter(
+                pk__in=[recipe.pk for recipe in recipes],
+            ).update(search_vector=get_search_vector())
+        return len(recipes)
+
+    def limit_per_author(self, limit):
+        """
+        Не больше limit последних рецептов каждого автора выборки.
+
+        Номер рецепта у автора считает ROW_NUMBER() в подзапросе: в
+        Django 3.2 фильтровать по оконной функции в самом запросе нельзя.
+        """
+        ranked = self.order_by().annotate(row_number=Window(
+            RowNumber(),
+            partition_by=F('author_id'),
+            order_by=(F('pub_date').desc(), F('id').desc()),
+        )).values('pk', 'row_number')
+        sql, params = ranked.query.sql_with_params()
+        pk_column = self.model._meta.pk.column
+        return self.filter(pk__in=RawSQL(
+            f'SELECT ranked.{pk_column} FROM ({sql}) ranked '
+            f'WHERE ranked.row_number <= %s',
+            (*params, limit)))
+
+    def allocate_ids(self, count):
+        """
+        Id для новых строк из последовательности Postgres одним запросом.
+
+        Позволяет посчитать зависящие от id поля до INSERT. На базах без
+        последовательностей возвращает None.
+        """
+        connection = connections[self.db]
+        if connection.vendor != 'postgresql':
+            return None
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+                'FROM generate_series(1, %s)',
+                (self.model._meta.db_table, self.model._meta.pk.column,
+                 count))
+            return [row[0] for row in cursor.fetchall()]
+
+    def with_any_tags(self, tags):
+        """
+        Рецепты, у которых есть хотя бы один из тегов.
+
+        На Postgres — пересечение массива id тегов рецепта (tag_ids &&
+        ARRAY[...]) по GIN-индексу, без JOIN с таблицей связи. На других
+        СУБД — подзапрос к таблице связи.
+        """
+        tag_ids = [tag.pk for tag in tags]
+        if connections[self.db].vendor == 'postgresql':
+            return self.filter(tag_ids__overlap=tag_ids)
+        return self.filter(pk__in=self.model.tags.through.objects.filter(
+            tag_id__in=tag_ids).values('recipe_id'))
+
+    def update_tag_ids(self):
+        """Пересчет id тегов рецептов выборки по таблице связи."""
+        recipe_ids = list(self.order_by().values_list('pk', flat=True))
+        tag_ids = {recipe_id: [] for recipe_id in recipe_ids}
+        for recipe_id, tag_id in self.model.tags.through.objects.filter(
+                recipe_id__in=recipe_ids).order_by(
+                    'tag_id').values_list('recipe_id', 'tag_id'):
+            tag_ids[recipe_id].append(tag_id)
+        self.model.objects.bulk_update(
+            [self.model(pk=recipe_id, tag_ids=ids)
+             for recipe_id, ids in tag_ids.items()],
+            ('tag_ids',), batch_size=500)
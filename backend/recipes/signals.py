@@ -0,0 +1,67 @@
+"""Сигналы."""
+
+from django.db.models.signals import (m2m_changed,  # type: ignore
+                                      post_delete, post_save, pre_delete)
+from django.dispatch import receiver  # type: ignore
+
+from .models import Ingredient, Recipe, Tag
+
+
+def get_related_recipes(sender, instance):
+    """Рецепты, в поисковый документ которых входит тег или ингредиент."""
+    if sender is Tag:
+        return Recipe.objects.filter(tags=instance)
+    return Recipe.objects.filter(ingredients=instance)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def update_search_documents(sender, instance, created, **kwargs):
+    """Пересчет поисковых документов при переименовании."""
+    if not created:
+        get_related_recipes(sender, instance).update_search_documents()
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def remember_search_recipes(sender, instance, **kwargs):
+    """Запоминание рецептов до каскадного удаления связей."""
+    instance.search_recipe_ids = list(get_related_recipes(
+        sender, instance).values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def remove_from_search_documents(sender, instance, **kwargs):
+    """Пересчет поисковых документов после удаления."""
+    Recipe.objects.filter(
+        pk__in=instance.search_recipe_ids).update_search_documents()
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def update_tag_ids(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Синхронизация id тегов рецептов с таблицей связи.
+
+    Со стороны рецепта массив пересчитывается и у объекта в памяти,
+    чтобы последующий save() его не затер. Со стороны тега
+    пересчитываются затронутые рецепты.
+    """
+    if action == 'pre_clear' and reverse:
+        instance.tag_recipe_ids = list(
+            instance.recipes.values_list('pk', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        instance.update_tag_ids()
+        return
+    if action == 'post_clear':
+        pk_set = instance.tag_recipe_ids
+    Recipe.objects.filter(pk__in=pk_set).update_tag_ids()
+
+
+@receiver(post_delete, sender=Tag)
+def remove_deleted_tag_id(sender, instance, **kwargs):
+    """Удаление id удаленного тега из рецептов."""
+    Recipe.objects.filter(
+        pk__in=instance.search_recipe_ids).update_tag_ids()
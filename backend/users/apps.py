@@ -7,3 +7,7 @@ class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
     verbose_name = 'Пользователи'
+
+    def ready(self):
+        """Подключение сигналов."""
+        from . import signals  # noqa: F401
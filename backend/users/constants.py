@@ -3,3 +3,5 @@
 NAME_MAX_LENGTH: int = 150
 EMAIL_MAX_LENGTH: int = 254
 MAX_PASSWORD_LENGTH: int = 128
+EXPORT_FORMAT_MAX_LENGTH: int = 8
+CART_HASH_LENGTH: int = 64
@@ -0,0 +1,43 @@
+"""Проверка и пересборка сводных списков покупок."""
+
+from django.core.management.base import BaseCommand  # type: ignore
+
+from users import shopping_list
+from users.models import ShoppingCart, ShoppingListItem
+
+BATCH_SIZE: int = 500
+
+
+class Command(BaseCommand):
+    """Команда проверки сводных списков покупок."""
+
+    help = ('Сравнивает сводные списки покупок с суммами по спискам '
+            'покупок и пересобирает разошедшиеся.')
+
+    def add_arguments(self, parser):
+        """Параметры команды."""
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help='Только показать пользователей с расхождениями.')
+
+    def handle(self, *args, **options):
+        """Проверка пользователей пакетами."""
+        user_ids = sorted(
+            set(ShoppingCart.objects.values_list('user_id', flat=True))
+            | set(ShoppingListItem.objects.values_list('user_id', flat=True))
+        )
+        drifted = []
+        for start in range(0, len(user_ids), BATCH_SIZE):
+            batch = shopping_list.find_drifted(
+                user_ids[start:start + BATCH_SIZE])
+            if batch and not options['dry_run']:
+                shopping_list.rebuild(batch)
+            drifted.extend(sorted(batch))
+        if drifted:
+            self.stdout.write(self.style.WARNING(
+                f'Расхождения у пользователей: '
+                f'{", ".join(map(str, drifted))}.'))
+        action = 'найдено' if options['dry_run'] else 'пересобрано'
+        self.stdout.write(self.style.SUCCESS(
+            f'Проверено {len(user_ids)} пользователей, '
+            f'{action} {len(drifted)}.'))
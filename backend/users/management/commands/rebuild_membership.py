@@ -0,0 +1,28 @@
+"""Пересборка множеств избранного, списка покупок и подписок в Redis."""
+
+from django.core.management.base import BaseCommand  # type: ignore
+from django_redis import get_redis_connection  # type: ignore
+
+from users.membership import MEMBERSHIP_SETS
+
+
+class Command(BaseCommand):
+    """Команда пересборки множеств."""
+
+    help = ('Пересобирает в Redis множества избранного, списка покупок '
+            'и подписок пользователей по данным базы.')
+
+    def handle(self, *args, **options):
+        """Удаление всех множеств и загрузка их из базы."""
+        redis = get_redis_connection('default')
+        for membership_set in MEMBERSHIP_SETS.values():
+            keys = list(redis.scan_iter(membership_set.get_key('*')))
+            if keys:
+                redis.delete(*keys)
+            user_ids = (membership_set.model.objects
+                        .values_list('user_id', flat=True)
+                        .distinct().order_by())
+            for user_id in user_ids:
+                membership_set.load(user_id)
+            self.stdout.write(self.style.SUCCESS(
+                f'{membership_set.name}: {len(user_ids)} пользователей.'))
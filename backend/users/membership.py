@@ -0,0 +1,132 @@
+"""Множества id избранного, списка покупок и подписок в Redis."""
+
+from django.conf import settings  # type: ignore
+from django.db import transaction  # type: ignore
+from django_redis import get_redis_connection  # type: ignore
+from redis.exceptions import WatchError  # type: ignore
+
+from .models import Favorite, ShoppingCart, Subscription
+
+LOADED_MARKER: int = 0
+LOAD_ATTEMPTS: int = 3
+
+
+class MembershipSet:
+    """
+    Множество id объектов пользователя в Redis — зеркало таблицы связи.
+
+    Загружается из базы при первом обращении и обновляется при
+    добавлении и удалении строк. Метка LOADED_MARKER отличает
+    загруженное пустое множество от отсутствующего.
+    """
+
+    timeout = settings.CACHE_TIMEOUT
+
+    def __init__(self, name, model, object_field):
+        """Имя множества, модель связи и поле id объекта."""
+        self.name = name
+        self.model = model
+        self.object_field = object_field
+
+    @property
+    def object_model(self):
+        """Модель объектов множества: рецепт или автор."""
+        return self.model._meta.get_field(self.object_field).related_model
+
+    @property
+    def redis(self):
+        """Соединение с Redis."""
+        return get_redis_connection('default')
+
+    def get_key(self, user_id):
+        """Ключ множества пользователя."""
+        return f'membership:{self.name}:{user_id}'
+
+    def read(self, user_id):
+        """Id объектов пользователя из базы."""
+        return set(self.model.objects.filter(
+            user_id=user_id).values_list(self.object_field, flat=True))
+
+    def load(self, user_id):
+        """
+        Загрузка множества пользователя из базы.
+
+        Ключ отслеживается WATCH до чтения базы. Если SADD или SREM
+        после фиксации другой транзакции изменили множество до записи,
+        запись отменяется и загрузка повторяется; после LOAD_ATTEMPTS
+        неудач возвращаются данные базы без записи в Redis.
+        """
+        key = self.get_key(user_id)
+        with self.redis.pipeline() as pipe:
+            for _ in range(LOAD_ATTEMPTS):
+                try:
+                    pipe.watch(key)
+                    object_ids = self.read(user_id)
+                    pipe.multi()
+                    pipe.delete(key)
+                    pipe.sadd(key, LOADED_MARKER, *object_ids)
+                    pipe.expire(key, self.timeout)
+                    pipe.execute()
+                    return object_ids
+                except WatchError:
+                    continue
+        return object_ids
+
+    def parse(self, user_id, members):
+        """Id из ответа SMEMBERS или загрузка, если множества нет."""
+        object_ids = {int(member) for member in members}
+        if LOADED_MARKER not in object_ids:
+            return self.load(user_id)
+        object_ids.discard(LOADED_MARKER)
+        return object_ids
+
+    def members(self, user_id):
+        """Все id объектов пользователя."""
+        return self.parse(user_id, self.redis.smembers(self.get_key(user_id)))
+
+    def contains(self, user_id, object_id):
+        """Есть ли объект в множестве пользователя."""
+        loaded, member = self.redis.smismember(
+            self.get_key(user_id), (LOADED_MARKER, object_id))
+        if not loaded:
+            return object_id in self.load(user_id)
+        return bool(member)
+
+    def add(self, user_id, *object_ids):
+        """Добавление id после фиксации транзакции."""
+        key = self.get_key(user_id)
+        transaction.on_commit(lambda: self.redis.sadd(key, *object_ids))
+
+    def remove(self, user_id, *object_ids):
+        """Удаление id после фиксации транзакции."""
+        key = self.get_key(user_id)
+        transaction.on_commit(lambda: self.redis.srem(key, *object_ids))
+
+    def forget(self, user_id):
+        """Сброс множества, оно загрузится из базы при обращении."""
+        key = self.get_key(user_id)
+        transaction.on_commit(lambda: self.redis.delete(key))
+
+
+favorites = MembershipSet('favorites', Favorite, 'recipe_id')
+shopping_cart = MembershipSet('shopping_cart', ShoppingCart, 'recipe_id')
+subscriptions = MembershipSet('subscriptions', Subscription, 'author_id')
+
+MEMBERSHIP_SETS = {
+    Favorite: favorites,
+    ShoppingCart: shopping_cart,
+    Subscription: subscriptions,
+}
+
+
+def get_user_members(user_id, *membership_sets):
+    """Id объектов пользователя из нескольких множеств за одно обращение."""
+    redis = get_redis_connection('default')
+    with redis.pipeline(transaction=False) as pipe:
+        for membership_set in membership_sets:
+            pipe.smembers(membership_set.get_key(user_id))
+        replies = pipe.execute()
+    return tuple(
+        membership_set.parse(user_id, members)
+        for membership_set, members in zip(membership_sets, replies)
+    )
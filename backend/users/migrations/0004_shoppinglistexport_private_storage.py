@@ -0,0 +1,19 @@
+# Generated by Django 3.2.3 on 2026-10-17 08:00
+
+from django.db import migrations, models
+import users.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_shoppinglistexport'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='shoppinglistexport',
+            name='file',
+            field=models.FileField(blank=True, storage=users.models.get_export_storage, upload_to='shopping_lists/', verbose_name='Файл'),
+        ),
+    ]
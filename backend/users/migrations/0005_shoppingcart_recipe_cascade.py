@@ -0,0 +1,20 @@
+# Generated by Django 3.2.3 on 2026-10-17 08:20
+
+from django.db import migrations, models
+import users.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0010_recipe_tag_ids'),
+        ('users', '0004_shoppinglistexport_private_storage'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='shoppingcart',
+            name='recipe',
+            field=models.ForeignKey(on_delete=users.models.cascade_from_recipe, related_name='recipe_shopping_cart', to='recipes.recipe', verbose_name='Рецепт'),
+        ),
+    ]
@@ -1,13 +1,18 @@
 """Модели пользователей."""
 
+import uuid
+
 from django.db import models  # type:ignore
 from django.contrib.auth.models import AbstractUser  # type:ignore
+from django.core.files.storage import FileSystemStorage  # type:ignore
 from django.core.validators import MaxLengthValidator  # type:ignore
 from django.conf import settings  # type: ignore
+from django.utils.functional import cached_property  # type: ignore
 
 from .validators import (validate_username, validate_email,
                          MaxLengthPasswordValidator)
-from .constants import NAME_MAX_LENGTH, EMAIL_MAX_LENGTH, MAX_PASSWORD_LENGTH
+from .constants import (NAME_MAX_LENGTH, EMAIL_MAX_LENGTH, MAX_PASSWORD_LENGTH,
+                        EXPORT_FORMAT_MAX_LENGTH, CART_HASH_LENGTH)
 
 
 class Role(models.TextChoices):
@@ -22,6 +27,20 @@ def get_role_max_length():
     return max(len(role[0]) for role in Role.choices)
 
 
+class ExportStatus(models.TextChoices):
+    """Состояния выгрузки списка покупок."""
+
+    PENDING = 'pending', 'В очереди'
+    RUNNING = 'running', 'Выполняется'
+    DONE = 'done', 'Готово'
+    FAILED = 'failed', 'Ошибка'
+
+
+def get_export_status_max_length():
+    """Длина поля состояния выгрузки."""
+    return max(len(export_status[0]) for export_status in ExportStatus.choices)
+
+
 class UserWithSubscriptions(AbstractUser):
     """Модель пользователя с подписками."""
 
@@ -101,10 +120,16 @@ class UserWithSubscriptions(AbstractUser):
         """Строковое представление."""
         return self.username
 
-    @property
+    @cached_property
     def is_superuser_or_admin(self):
-        """Является ли пользователь суперпользователем или администратором."""
-        self.refresh_from_db()
+        """
+        Является ли пользователь суперпользователем или администратором.
+
+        Вычисляется один раз для объекта, то есть для request.user — один
+        раз за запрос. Роль и флаг суперпользователя входят в снимок
+        пользователя при аутентификации по токену; снимок сбрасывается
+        при сохранении пользователя, в том числе при смене роли в админке.
+        """
         return self.is_superuser or self.role == Role.ADMIN
 
 
@@ -139,6 +164,18 @@ class Favorite(models.Model):
         return f'Избранное: {self.user.username} - {self.recipe.name}'
 
 
+def cascade_from_recipe(collector, field, sub_objs, using):
+    """
+    Каскадное удаление строк списка покупок вместе с рецептом.
+
+    Строки помечаются: сводные списки при удалении рецепта пересчитывает
+    сигнал рецепта, одной дельтой на всех пользователей.
+    """
+    for shopping_cart in sub_objs:
+        shopping_cart.recipe_deleted = True
+    models.CASCADE(collector, field, sub_objs, using)
+
+
 class ShoppingCart(models.Model):
     """Модель списка покупок."""
 
@@ -150,7 +187,7 @@ class ShoppingCart(models.Model):
     )
     recipe = models.ForeignKey(
         'recipes.Recipe',
-        on_delete=models.CASCADE,
+        on_delete=cascade_from_recipe,
         related_name='recipe_shopping_cart',
         verbose_name='Рецепт',
     )
@@ -170,6 +207,93 @@ class ShoppingCart(models.Model):
         return f'Список покупок: {self.user.username} - {self.recipe.name}'
 
 
+class ShoppingListItem(models.Model):
+    """Ингредиент сводного списка покупок пользователя."""
+
+    user = models.ForeignKey(
+        UserWithSubscriptions,
+        on_delete=models.CASCADE,
+        related_name='shopping_list',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        'recipes.Ingredient',
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент',
+    )
+    amount = models.IntegerField(verbose_name='Количество')
+
+    class Meta:
+        """Настройки модели."""
+
+        constraints = (
+            models.UniqueConstraint(fields=('user', 'ingredient'),
+                                    name='unique_shopping_list_item'),
+        )
+        verbose_name = 'Ингредиент списка покупок'
+        verbose_name_plural = 'Сводный список покупок'
+
+    def __str__(self):
+        """Строковое представление."""
+        return (f'{self.user.username}: {self.ingredient.name} '
+                f'{self.amount} {self.ingredient.measurement_unit}')
+
+
+def get_export_storage():
+    """Хранилище выгрузок вне MEDIA_ROOT: nginx их не раздает."""
+    return FileSystemStorage(location=settings.SHOPPING_LIST_EXPORT_ROOT)
+
+
+class ShoppingListExport(models.Model):
+    """
+    Задание на выгрузку списка покупок в файл.
+
+    Файл называется по хэшу содержимого списка и формату, поэтому
+    одинаковые списки разных пользователей используют один файл. Файлы
+    лежат в закрытом хранилище и отдаются только владельцу задания.
+    """
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4,
+                          editable=False)
+    user = models.ForeignKey(
+        UserWithSubscriptions,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_exports',
+        verbose_name='Пользователь',
+    )
+    format = models.CharField(max_length=EXPORT_FORMAT_MAX_LENGTH,
+                              verbose_name='Формат')
+    cart_hash = models.CharField(max_length=CART_HASH_LENGTH,
+                                 verbose_name='Хэш списка покупок')
+    status = models.CharField(max_length=get_export_status_max_length(),
+                              choices=ExportStatus.choices,
+                              default=ExportStatus.PENDING,
+                              verbose_name='Состояние')
+    file = models.FileField(upload_to='shopping_lists/', blank=True,
+                            storage=get_export_storage,
+                            verbose_name='Файл')
+    error = models.TextField(blank=True, verbose_name='Ошибка')
+    created = models.DateTimeField(auto_now_add=True,
+                                   verbose_name='Создано')
+    updated = models.DateTimeField(auto_now=True, verbose_name='Изменено')
+
+    class Meta:
+        """Настройки модели."""
+
+        ordering = ('created',)
+        indexes = (
+            models.Index(fields=('status', 'created'),
+                         name='export_queue_idx'),
+        )
+        verbose_name = 'Выгрузка списка покупок'
+        verbose_name_plural = 'Выгрузки списка покупок'
+
+    def __str__(self):
+        """Строковое представление."""
+        return f'{self.user.username}: {self.format} ({self.status})'
+
+
 class Subscription(models.Model):
     """Модель подписок."""
 
@@ -0,0 +1,125 @@
+"""Сводный список покупок: суммы ингредиентов по пользователю."""
+
+from collections import Counter
+
+from django.db import transaction  # type: ignore
+from django.db.models import Case, F, IntegerField  # type: ignore
+from django.db.models import Sum, Value, When  # type: ignore
+
+from recipes.models import RecipeIngredient
+from .models import ShoppingCart, ShoppingListItem
+
+
+def get_recipe_amounts(recipe_ids):
+    """Количества ингредиентов рецептов, сложенные по ингредиенту."""
+    amounts = Counter()
+    for ingredient_id, amount in RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids).values_list('ingredient_id', 'amount'):
+        amounts[ingredient_id] += amount
+    return amounts
+
+
+def apply_deltas(user_ids, deltas):
+    """
+    Изменение количеств в сводных списках пользователей.
+
+    deltas — изменение по id ингредиента, одинаковое для всех
+    пользователей. Недостающие строки создаются, строки с нулевым
+    количеством удаляются; число запросов не зависит от размера.
+    """
+    deltas = {ingredient_id: delta
+              for ingredient_id, delta in deltas.items() if delta}
+    user_ids = list(user_ids)
+    if not deltas or not user_ids:
+        return
+    with transaction.atomic():
+        ShoppingListItem.objects.bulk_create(
+            (ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                              amount=0)
+             for user_id in user_ids
+             for ingredient_id, delta in deltas.items() if delta > 0),
+            ignore_conflicts=True,
+        )
+        items = ShoppingListItem.objects.filter(
+            user_id__in=user_ids, ingredient_id__in=deltas)
+        items.update(amount=F('amount') + Case(
+            *(When(ingredient_id=ingredient_id, then=Value(delta))
+              for ingredient_id, delta in deltas.items()),
+            default=Value(0),
+            output_field=IntegerField(),
+        ))
+        items.filter(amount__lte=0).delete()
+
+
+def add_recipes(user_ids, recipe_ids, sign=1):
+    """Добавление (sign=1) или вычитание (sign=-1) рецептов из списков."""
+    apply_deltas(user_ids, {
+        ingredient_id: sign * amount
+        for ingredient_id, amount in get_recipe_amounts(recipe_ids).items()
+    })
+
+
+def remove_recipe(recipe_id):
+    """Вычитание рецепта из списков всех, у кого он есть, одной дельтой."""
+    add_recipes(
+        ShoppingCart.objects.filter(recipe_id=recipe_id).values_list(
+            'user_id', flat=True),
+        (recipe_id,), sign=-1)
+
+
+def change_recipe_amounts(recipe_id, old_amounts, new_amounts):
+    """Учет правки ингредиентов рецепта в списках, где он есть."""
+    deltas = Counter(new_amounts)
+    deltas.subtract(old_amounts)
+    if not any(deltas.values()):
+        return
+    apply_deltas(
+        ShoppingCart.objects.filter(recipe_id=recipe_id).values_list(
+            'user_id', flat=True),
+        deltas)
+
+
+def get_expected_items(user_ids):
+    """Суммы ингредиентов по спискам покупок: {(user_id, id): сумма}."""
+    return {
+        (row['user_id'], row['ingredient_id']): row['amount']
+        for row in ShoppingCart.objects.filter(
+            user_id__in=user_ids,
+            recipe__recipe_ingredients__isnull=False,
+        ).values(
+            'user_id',
+            ingredient_id=F('recipe__recipe_ingredients__ingredient_id'),
+        ).annotate(
+            amount=Sum('recipe__recipe_ingredients__amount'),
+        ).order_by()
+    }
+
+
+def get_stored_items(user_ids):
+    """Суммы из сводных списков: {(user_id, id): сумма}."""
+    return {
+        (user_id, ingredient_id): amount
+        for user_id, ingredient_id, amount in ShoppingListItem.objects.filter(
+            user_id__in=user_ids,
+        ).values_list('user_id', 'ingredient_id', 'amount')
+    }
+
+
+def rebuild(user_ids):
+    """Пересборка сводных списков пользователей по спискам покупок."""
+    user_ids = list(user_ids)
+    with transaction.atomic():
+        ShoppingListItem.objects.filter(user_id__in=user_ids).delete()
+        ShoppingListItem.objects.bulk_create(
+            ShoppingListItem(user_id=user_id, ingredient_id=ingredient_id,
+                             amount=amount)
+            for (user_id, ingredient_id), amount
+            in get_expected_items(user_ids).items()
+        )
+
+
+def find_drifted(user_ids):
+    """Пользователи, чьи сводные списки расходятся со списками покупок."""
+    expected = get_expected_items(user_ids)
+    stored = get_stored_items(user_ids)
+    return {user_id for (user_id, _), _ in expected.items() ^ stored.items()}
@@ -0,0 +1,114 @@
+"""Сигналы."""
+
+from django.db.models.signals import (m2m_changed,  # type: ignore
+                                      post_delete, post_save, pre_delete)
+from django.dispatch import receiver  # type: ignore
+
+from recipes.models import Recipe
+from . import shopping_list
+from .membership import MEMBERSHIP_SETS
+from .models import Favorite, ShoppingCart, Subscription
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Subscription)
+def add_membership(sender, instance, created, **kwargs):
+    """Добавление id в множество пользователя."""
+    if created:
+        membership_set = MEMBERSHIP_SETS[sender]
+        membership_set.add(
+            instance.user_id,
+            getattr(instance, membership_set.object_field))
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Subscription)
+def remove_membership(sender, instance, **kwargs):
+    """Удаление id из множества пользователя."""
+    membership_set = MEMBERSHIP_SETS[sender]
+    membership_set.remove(
+        instance.user_id,
+        getattr(instance, membership_set.object_field))
+
+
+@receiver(m2m_changed, sender=Favorite)
+@receiver(m2m_changed, sender=ShoppingCart)
+@receiver(m2m_changed, sender=Subscription)
+def change_membership_m2m(sender, action, instance, reverse, pk_set,
+                          **kwargs):
+    """
+    Обновление множеств при add/remove/clear через связь многие-ко-многим.
+
+    Подписки симметричны: вместе с подпиской пользователя на автора
+    меняется и обратная строка автора.
+    """
+    membership_set = MEMBERSHIP_SETS[sender]
+    symmetrical = sender is Subscription
+    if action == 'pre_clear':
+        if reverse or symmetrical:
+            for user_id in sender.objects.filter(**{
+                    membership_set.object_field: instance.pk,
+            }).values_list('user_id', flat=True):
+                membership_set.forget(user_id)
+        if not reverse:
+            membership_set.forget(instance.pk)
+        return
+    if action not in {'post_add', 'post_remove'}:
+        return
+    change = (membership_set.add if action == 'post_add'
+              else membership_set.remove)
+    if reverse:
+        for user_id in pk_set:
+            change(user_id, instance.pk)
+        return
+    if pk_set:
+        change(instance.pk, *pk_set)
+    if symmetrical:
+        for user_id in pk_set:
+            change(user_id, instance.pk)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(sender, instance, created, **kwargs):
+    """Добавление ингредиентов рецепта в сводный список."""
+    if created:
+        shopping_list.add_recipes((instance.user_id,), (instance.recipe_id,))
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_list(sender, instance, **kwargs):
+    """
+    Вычитание ингредиентов рецепта из сводного списка.
+
+    До удаления, пока ингредиенты рецепта еще в базе. Строки, удаляемые
+    каскадом с рецептом, учитывает remove_deleted_recipe.
+    """
+    if getattr(instance, 'recipe_deleted', False):
+        return
+    shopping_list.add_recipes(
+        (instance.user_id,), (instance.recipe_id,), sign=-1)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remove_deleted_recipe(sender, instance, **kwargs):
+    """Вычитание удаляемого рецепта из всех сводных списков разом."""
+    shopping_list.remove_recipe(instance.pk)
+
+
+@receiver(m2m_changed, sender=ShoppingCart)
+def add_to_shopping_list_m2m(sender, action, instance, reverse, pk_set,
+                             **kwargs):
+    """
+    Добавление в сводные списки при add().
+
+    add() вставляет строки без post_save, а remove() и clear() удаляют
+    их через QuerySet.delete(), который отправляет pre_delete.
+    """
+    if action != 'post_add':
+        return
+    if reverse:
+        shopping_list.add_recipes(pk_set, (instance.pk,))
+    else:
+        shopping_list.add_recipes((instance.pk,), pk_set)